@@ -4,21 +4,15 @@ import logging
 import os
 import requests
 import threading
-import webbrowser
 import uuid
+import sys
+import time
+from collections import deque
 from datetime import datetime, timedelta
 from flask import Flask, render_template, request, jsonify, session, send_file
-from colorama import init
-from termcolor import colored
 from logging.handlers import RotatingFileHandler
-from diffusers import StableDiffusionPipeline
-import torch
-from PIL import Image
 import io
 
-# Initialize colorama for cross-platform compatibility
-init(autoreset=True)
-
 class Config:
     """Configuration class for the application"""
     COMPANY_NAME = "Rango Productions"
@@ -35,24 +29,35 @@ class Config:
     LOG_MAX_SIZE = 1 * 1024 * 1024  # 1 MB
     LOG_BACKUP_COUNT = 5
     IMAGE_OUTPUT_DIR = "generated_images"
+    HISTORY_WINDOW = 10  # messages kept per session and sent upstream
 
 class ImageGenerator:
-    """Handles image generation using Stable Diffusion"""
+    """Handles image generation using Stable Diffusion
+    
+    torch and diffusers are imported on the first /img request, so workers
+    that only chat never load them.
+    """
     def __init__(self):
         self.model_id = "runwayml/stable-diffusion-v1-5"
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.device = None
         self.pipeline = None
+        self.lock = threading.Lock()
         self.logger = logging.getLogger('ImageGenerator')
         
     def initialize(self):
         """Initialize the Stable Diffusion pipeline"""
         try:
-            if self.pipeline is None:
-                self.pipeline = StableDiffusionPipeline.from_pretrained(
-                    self.model_id,
-                    torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32
-                )
-                self.pipeline = self.pipeline.to(self.device)
+            with self.lock:
+                if self.pipeline is None:
+                    import torch
+                    from diffusers import StableDiffusionPipeline
+                    
+                    self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+                    pipeline = StableDiffusionPipeline.from_pretrained(
+                        self.model_id,
+                        torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32
+                    )
+                    self.pipeline = pipeline.to(self.device)
             return True
         except Exception as e:
             self.logger.error(f"Error initializing image generator: {str(e)}")
@@ -78,6 +83,16 @@ class ImageGenerator:
             self.logger.error(f"Error generating images: {str(e)}")
             return None
 
+class ChatMessage:
+    """Compact conversation turn: interned role, content and a numeric timestamp"""
+    
+    __slots__ = ('role', 'content', 'timestamp')
+    
+    def __init__(self, role, content):
+        self.role = sys.intern(role)
+        self.content = content
+        self.timestamp = time.time()
+
 class ConversationManager:
     """Manages conversation histories for different sessions"""
     def __init__(self):
@@ -97,7 +112,7 @@ class ConversationManager:
             conv_id = str(uuid.uuid4())
             self.session_map[session_id] = conv_id
             self.conversations[conv_id] = {
-                'history': [],
+                'history': deque(maxlen=Config.HISTORY_WINDOW),
                 'last_access': datetime.now(),
                 'session_id': session_id
             }
@@ -108,11 +123,7 @@ class ConversationManager:
         """Add a message to the conversation history"""
         try:
             conv_id = self.get_conversation_id(session_id)
-            self.conversations[conv_id]['history'].append({
-                'content': message,
-                'role': role,
-                'timestamp': datetime.now().isoformat()
-            })
+            self.conversations[conv_id]['history'].append(ChatMessage(role, message))
             self.conversations[conv_id]['last_access'] = datetime.now()
             self.logger.debug(f"Added message for session {session_id[:8]}...")
         except Exception as e:
@@ -123,7 +134,7 @@ class ConversationManager:
         """Get conversation history for a session"""
         try:
             conv_id = self.get_conversation_id(session_id)
-            return self.conversations[conv_id]['history']
+            return list(self.conversations[conv_id]['history'])
         except Exception as e:
             self.logger.error(f"Error getting history: {str(e)}")
             return []
@@ -165,7 +176,7 @@ class ChatAPI:
     def send_request(self, inputs, conversation_history, session_id):
         """Send request to the API and process response"""
         formatted_history = [
-            {'role': msg['role'], 'content': msg['content']}
+            {'role': msg.role, 'content': msg.content}
             for msg in conversation_history
         ]
 
@@ -254,13 +265,36 @@ app = Flask(__name__)
 app.secret_key = os.urandom(24)
 app.permanent_session_lifetime = timedelta(hours=24)
 
-# Initialize components
-setup_logging()
-conversation_manager = ConversationManager()
-chat_api = ChatAPI()
-image_generator = ImageGenerator()
+# Components are built by create_app(), not at import time
+conversation_manager = None
+chat_api = None
+image_generator = None
+components_lock = threading.Lock()
 logger = logging.getLogger('FlaskApp')
 
+def create_app():
+    """Application factory: build the shared components once and return the Flask app
+    
+    Importing this module starts no threads, so pre-fork servers can build
+    components in each worker (e.g. `gunicorn 'app:create_app()'`).
+    """
+    global conversation_manager, chat_api, image_generator
+    if image_generator is not None:
+        return app
+    
+    with components_lock:
+        if image_generator is None:
+            setup_logging()
+            conversation_manager = ConversationManager()
+            chat_api = ChatAPI()
+            image_generator = ImageGenerator()
+    return app
+
+@app.before_request
+def ensure_components():
+    """Build the components on the first request when the module-level app is served"""
+    create_app()
+
 @app.route('/')
 def index():
     """Route for the main page"""
@@ -331,14 +365,14 @@ def chat():
             f"But don't introduce yourself again and again and introduce yourself only if asked and when ever to do so only introduce yourself as {Config.BOT_NAME} by {Config.COMPANY_NAME}."
         )
 
-        # Add user message to history
-        conversation_manager.add_message(session_id, prompt, Config.BOT_ROLE)
-        
         # Get conversation history
         history = conversation_manager.get_history(session_id)
         
-        # Get response from API
-        response = chat_api.send_request(user_message, history, session_id)
+        # Get response from API; the instructions are sent with this turn only
+        response = chat_api.send_request(prompt, history, session_id)
+        
+        # Store the plain user message, not the instruction-laden prompt
+        conversation_manager.add_message(session_id, user_message, Config.BOT_ROLE)
         
         # Add bot response to history
         conversation_manager.add_message(session_id, response, Config.CHAT_HISTORY_BOT_ROLE)
@@ -357,11 +391,17 @@ def serve_image(filename):
 def open_browser():
     """Open the browser when the application starts"""
     try:
+        import webbrowser
         webbrowser.open("http://127.0.0.1:8080")
     except Exception as e:
         logger.error(f"Error opening browser: {str(e)}")
 
 if __name__ == '__main__':
+    # Initialize colorama for cross-platform compatibility
+    from colorama import init
+    init(autoreset=True)
+    
+    create_app()
     try:
         threading.Timer(1, open_browser).start()
         app.run(host='0.0.0.0', port=8080, debug=False)
@@ -7,22 +7,84 @@ import logging
 import os
 import requests
 import threading
-import webbrowser
 import uuid
 import re
 import time
 import random
-from datetime import datetime, timedelta
-from flask import Flask, render_template, request, jsonify, session
-from colorama import init
-from termcolor import colored
+import asyncio
+import atexit
+import codecs
+import contextlib
+import contextvars
+import functools
+import hashlib
+import importlib.util
+import queue
+import socket
+import sqlite3
+import sys
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import timedelta
+from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context
+from flask.sessions import SecureCookieSessionInterface
 from logging.handlers import RotatingFileHandler
-from bs4 import BeautifulSoup
 from urllib.parse import quote_plus, urljoin, urlparse
-import html5lib
+from http.cookies import SimpleCookie
+from itsdangerous import BadSignature
 
-# Initialize colorama for cross-platform compatibility
-init(autoreset=True)
+class _LazyModule:
+    """Stands in for a module until its first attribute access
+    
+    The import runs once under a lock, so worker threads racing on first use
+    all see the fully executed module (importlib's LazyLoader does not
+    guarantee that).
+    """
+    
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+    
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+                module = self._module
+        return getattr(module, attr)
+
+def lazy_import(name):
+    """Module that is only imported on first attribute access, or None if not installed
+    
+    Keeps worker start cheap for dependencies that a given deployment may
+    never touch, such as BeautifulSoup when the lxml extractor is in use.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    try:
+        spec = importlib.util.find_spec(name)
+    except ImportError:
+        return None
+    if spec is None:
+        return None
+    return _LazyModule(name)
+
+bs4 = lazy_import('bs4')
+httpx = lazy_import('httpx')  # optional; only the async serving mode uses it
+asgiref_wsgi = lazy_import('asgiref.wsgi')  # optional; without it the ASGI server only serves /chat
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the standard json module is used instead
+    orjson = None
+
+try:
+    from lxml import etree as lxml_etree, html as lxml_html
+except ImportError:  # lxml is optional; the BeautifulSoup extractor still works
+    lxml_etree = lxml_html = None
 
 class Config:
     """Enhanced Configuration class for TurboTalk AI"""
@@ -35,10 +97,42 @@ class Config:
     API_URL = "https://https.extension.phind.com/agent/"
     SESSION_TIMEOUT = 24 * 3600  # 24 hours in seconds
     CLEANUP_INTERVAL = 3600  # 1 hour in seconds
+    SESSION_SHARDS = 16  # lock stripes in the session store
+    HISTORY_WINDOW = 10  # messages kept per session; matches what is sent upstream
+    HISTORY_COLD_STORAGE_DIR = None  # e.g. "history_archive" to keep older turns on disk
+    
+    # Context Window Configuration
+    CONTEXT_CHARS_PER_TOKEN = 4  # rough token estimate used for history budgets
+    CONTEXT_BUDGETS = {  # history tokens sent upstream with each stage
+        'thinking': 2000,
+        'plan': 2000,
+        'summary': 500,
+        'search_prompt': 0,  # query generation works from the summary alone
+        'search_topics': 0,
+        'final_response': 3000,
+        'default': 3000,
+    }
+    
+    # Session Store Configuration
+    SESSION_BACKEND = "memory"  # "memory", "sqlite" or "redis"
+    SESSION_DB_PATH = os.path.join('data', 'sessions.sqlite3')
+    SESSION_DB_POOL_SIZE = 4
+    SESSION_REDIS_URL = "redis://127.0.0.1:6379/0"
+    # Cookie signing key; every worker must share it or sessions break across workers
+    SECRET_KEY = os.environ.get('TURBOTALK_SECRET_KEY')
+    SECRET_KEY_PATH = os.path.join('data', 'secret_key')  # generated once when SECRET_KEY is unset
+    SESSION_WRITE_BATCH = 100  # queued writes that trigger an immediate flush
+    SESSION_FLUSH_INTERVAL = 0.05  # seconds between background flushes
+    SESSION_CACHE_MAX_BYTES = 16 * 1024 * 1024  # read-through cache of recent messages
+    SESSION_CACHE_TTL = 5  # seconds; bounds staleness across processes
     MAX_RETRIES = 3
     LOG_FILE = "turbotalk_enhanced.log"
     LOG_MAX_SIZE = 1 * 1024 * 1024  # 1 MB
     LOG_BACKUP_COUNT = 5
+    PROFILE_SLOW_REQUESTS = False  # sample stacks while /chat runs and keep the slow ones
+    PROFILE_SAMPLE_INTERVAL = 0.05  # seconds between stack samples
+    PROFILE_SLOW_THRESHOLD = 10  # seconds; faster requests are discarded
+    PROFILE_DIR = 'profiles'
     
     # Web Scraping Configuration
     WEB_SEARCH_ENGINES = [
@@ -55,186 +149,2150 @@ class Config:
     # AI Processing Configuration
     MAX_WEB_RESULTS = 5
     MAX_CONTENT_LENGTH = 1000
+    HTML_EXTRACTOR = "lxml"  # "lxml" (streaming fast path) or "soup" (BeautifulSoup)
+    PAGE_DOWNLOAD_BUDGET = 512 * 1024  # bytes read from any single page at most
+    PAGE_CHUNK_SIZE = 16 * 1024  # bytes per streamed read
+    PAGE_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
     THINKING_DELAY_RANGE = (1, 3)  # seconds
     TYPING_SPEED_RANGE = (0.5, 2.5)  # characters per second
+    PIPELINE_MAX_WORKERS = 16  # threads shared by all in-flight pipelines
+    PLANNER_MODE = "multi"  # "multi": stages 1-4 as separate calls, "compact": one JSON planning call
+    
+    # Concurrent Search Configuration
+    SEARCH_MAX_CONCURRENCY = 12  # outbound scraping requests in flight at once
+    SEARCH_PER_HOST_LIMIT = 4  # concurrent requests to any single host
+    SEARCH_DEADLINE = 15  # seconds; results finished by then are returned
+    SEARCH_REQUEST_TIMEOUT = 10  # seconds per engine query or page fetch
+    SPECULATIVE_SEARCH = False  # search the raw user message while stages 1-4 run
+    SPECULATIVE_SEARCH_RESULTS = 3
+    
+    # Query Planning Configuration
+    SEARCH_MAX_QUERIES = 4  # distinct searches per message
+    SEARCH_QUERY_MAX_CHARS = 100
+    SEARCH_QUERY_MAX_WORDS = 12  # longer text is prose, not a query
+    SEARCH_QUERY_SIMILARITY = 0.6  # token overlap at which queries are merged
+    
+    # Request Routing Configuration
+    ROUTING_ENABLED = True
+    TOPIC_KEYWORDS = {  # also drives the canned fallback replies
+        'science': ['physics', 'chemistry', 'biology', 'science', 'equation', 'theory', 'experiment'],
+        'environment': ['environment', 'climate', 'pollution', 'sustainability', 'carbon', 'green'],
+        'health': ['health', 'medical', 'wellness', 'nutrition', 'fitness', 'mental'],
+        'community': ['community', 'social', 'problem', 'society', 'help', 'volunteer'],
+    }
+    SMALLTALK_PHRASES = (
+        'hi', 'hello', 'hey', 'hi there', 'hello there', 'hey there',
+        'thanks', 'thank you', 'ok', 'okay', 'bye', 'goodbye',
+        'good morning', 'good evening', 'good night', 'how are you', 'who are you',
+        'what is your name', "what's your name", 'who made you', 'who created you',
+    )
+    SMALLTALK_MAX_WORDS = 6
+    FRESHNESS_KEYWORDS = ('latest', 'today', 'current', 'recent', 'news', 'this week', 'this year', 'price', 'weather')
+    SHORT_QUERY_WORDS = 3
+    ROUTING_TABLE = {  # request category -> pipeline profile: "direct", "search" or "full"
+        'smalltalk': 'direct',
+        'science': 'full',
+        'environment': 'full',
+        'health': 'full',
+        'community': 'full',
+        'freshness': 'search',
+        'short': 'search',
+        'default': 'full',
+    }
+    
+    # Upstream API Connection Pool Configuration
+    API_POOL_CONNECTIONS = 4  # number of per-host pools kept
+    API_POOL_MAXSIZE = 32  # keep-alive connections kept per host
+    API_KEEPALIVE_IDLE_TIMEOUT = 60  # seconds before idle connections are dropped
+    BREAKER_FAILURE_THRESHOLD = 5  # consecutive upstream failures that open the breaker
+    BREAKER_RECOVERY_TIMEOUT = 30  # seconds open before trial calls are let through
+    BREAKER_HALF_OPEN_CALLS = 1  # concurrent trial calls while half-open
+    COALESCE_UPSTREAM = True  # concurrent identical upstream requests share one call
+    COALESCE_FETCHES = True  # concurrent identical search queries and page fetches share one request
+    
+    # Response Cache Configuration
+    RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024  # 32 MB
+    RESPONSE_CACHE_TTL = 6 * 3600  # 6 hours in seconds
+    RESPONSE_CACHE_STAGES = {  # which pipeline stages may be served from cache
+        'thinking': True,
+        'plan': True,
+        'summary': True,
+        'search_prompt': True,
+        'search_topics': True,
+        'final_response': False,
+    }
+    
+    # Web Cache Configuration
+    WEB_CACHE_ENABLED = True
+    WEB_CACHE_PATH = os.path.join('cache', 'web_cache.sqlite3')
+    WEB_CACHE_MEMORY_BYTES = 16 * 1024 * 1024  # 16 MB
+    SEARCH_CACHE_TTL = 3600  # 1 hour in seconds
+    PAGE_CACHE_TTL = 24 * 3600  # 24 hours in seconds
+    WEB_CACHE_STALE_TTL = 7 * 24 * 3600  # stale entries kept this long for revalidation
+    WEB_CACHE_PURGE_EVERY = 500  # writes between purges of long-stale rows
+
+# Trace id of the request being handled, attached to every log record
+current_trace_id = contextvars.ContextVar('trace_id', default='-')
+current_span = contextvars.ContextVar('span', default=None)
+current_stage = contextvars.ContextVar('stage', default='request')
+
+def submit_in_context(executor, func, *args):
+    """Submit work to a thread pool, carrying the caller's trace context along"""
+    return executor.submit(contextvars.copy_context().run, profiler.track, func, *args)
+
+class TraceIdFilter(logging.Filter):
+    """Adds the current request's trace id to log records"""
+    
+    def filter(self, record):
+        record.trace_id = current_trace_id.get()
+        return True
+
+class Span:
+    """One timed unit of work and what it moved"""
+    
+    __slots__ = ('kind', 'name', 'started', 'bytes_in', 'bytes_out', 'cache', 'fallback', 'error')
+    
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.started = time.perf_counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cache = None
+        self.fallback = False
+        self.error = False
+
+class Tracer:
+    """Times spans of work and aggregates them into in-process Prometheus metrics"""
+    
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    
+    def __init__(self, prefix='turbotalk'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.histograms = {}  # (kind, name) -> [bucket counts, sum, count]
+        self.counters = {}  # (metric, labels) -> value
+        self.logger = logging.getLogger('Tracer')
+    
+    def new_trace(self):
+        """Start a trace for the current request and return its id"""
+        trace_id = uuid.uuid4().hex[:16]
+        current_trace_id.set(trace_id)
+        return trace_id
+    
+    @contextlib.contextmanager
+    def span(self, kind, name):
+        """Time a block; code inside can annotate it with note()"""
+        span = Span(kind, name)
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException:
+            span.error = True
+            raise
+        finally:
+            current_span.reset(token)
+            self._record(span, time.perf_counter() - span.started)
+    
+    def traced(self, kind, name):
+        """Decorator that wraps a function or coroutine in a span"""
+        def decorate(func):
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.span(kind, name):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+            
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(kind, name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+    
+    @staticmethod
+    def note(**fields):
+        """Annotate the innermost open span, if any"""
+        span = current_span.get()
+        if span is not None:
+            for field, value in fields.items():
+                setattr(span, field, value)
+    
+    def observe(self, kind, name, seconds):
+        """Add a duration measured outside of a span"""
+        with self.lock:
+            histogram = self.histograms.get((kind, name))
+            if histogram is None:
+                histogram = self.histograms[(kind, name)] = [[0] * len(self.BUCKETS), 0.0, 0]
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+    
+    def _count(self, metric, labels, amount=1):
+        key = (metric, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+    
+    def _record(self, span, seconds):
+        self.observe(span.kind, span.name, seconds)
+        labels = (('kind', span.kind), ('name', span.name))
+        with self.lock:
+            if span.bytes_in:
+                self._count('span_bytes_in_total', labels, span.bytes_in)
+            if span.bytes_out:
+                self._count('span_bytes_out_total', labels, span.bytes_out)
+            if span.cache:
+                self._count('span_cache_total', labels + (('result', span.cache),))
+            if span.fallback:
+                self._count('span_fallback_total', labels)
+            if span.error:
+                self._count('span_errors_total', labels)
+        self.logger.debug(
+            f"{span.kind}:{span.name} {seconds * 1000:.1f}ms in={span.bytes_in} out={span.bytes_out} "
+            f"cache={span.cache} fallback={span.fallback}"
+        )
+    
+    @staticmethod
+    def _labels(pairs):
+        return ",".join(f'{key}="{str(value)}"' for key, value in pairs)
+    
+    def render(self, gauges=(), counters=()):
+        """Prometheus text exposition of every histogram and counter
+        
+        gauges and counters are iterables of (name, labels, value) that the
+        caller wants to publish alongside: point-in-time values and
+        monotonically increasing totals kept elsewhere, respectively.
+        """
+        lines = []
+        metric = f"{self.prefix}_span_duration_seconds"
+        with self.lock:
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self.histograms.items()}
+            span_counters = dict(self.counters)
+        
+        lines.append(f"# HELP {metric} Duration of traced operations")
+        lines.append(f"# TYPE {metric} histogram")
+        for (kind, name), (buckets, total, count) in sorted(histograms.items()):
+            labels = self._labels((('kind', kind), ('name', name)))
+            for bound, bucket_count in zip(self.BUCKETS, buckets):
+                lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {bucket_count}')
+            lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{metric}_sum{{{labels}}} {total:.6f}")
+            lines.append(f"{metric}_count{{{labels}}} {count}")
+        
+        external = [(name, tuple(sorted(labels.items())), value, 'counter') for name, labels, value in counters]
+        external += [(name, tuple(sorted(labels.items())), value, 'gauge') for name, labels, value in gauges]
+        declared = set()
+        for name, labels, value, metric_type in (
+            [(name, labels, value, 'counter') for (name, labels), value in sorted(span_counters.items())] + external
+        ):
+            metric = f"{self.prefix}_{name}"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} {metric_type}")
+                declared.add(metric)
+            label_text = self._labels(labels)
+            lines.append(f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}")
+        
+        return "\n".join(lines) + "\n"
+
+tracer = Tracer()
+
+class SlowRequestProfiler:
+    """Low-rate stack sampler that keeps profiles of slow requests
+    
+    While a request is being profiled, one background thread samples the
+    stacks of every thread working for it: the handling thread plus any
+    pool thread its work was submitted to through submit_in_context.
+    Samples are kept as collapsed stacks rooted at the session and the
+    pipeline stage. Requests slower than the threshold are written to
+    Config.PROFILE_DIR in the format flamegraph tools read; the rest are
+    dropped.
+    """
+    
+    def __init__(self, enabled=None, interval=None, threshold=None, directory=None):
+        self.enabled = Config.PROFILE_SLOW_REQUESTS if enabled is None else enabled
+        self.interval = interval or Config.PROFILE_SAMPLE_INTERVAL
+        self.threshold = Config.PROFILE_SLOW_THRESHOLD if threshold is None else threshold
+        self.directory = directory or Config.PROFILE_DIR
+        self.lock = threading.Lock()
+        self.profiles = {}  # trace id -> profile being collected
+        self.threads = {}  # thread ident -> [profile, stage]
+        self.sampler = None
+        self.logger = logging.getLogger('SlowRequestProfiler')
+    
+    @contextlib.contextmanager
+    def request(self, session_id):
+        """Profile the enclosed request, dumping it if it turns out slow"""
+        if not self.enabled:
+            yield
+            return
+        
+        self._ensure_sampler()
+        trace_id = current_trace_id.get()
+        profile = {'trace_id': trace_id, 'session_id': session_id, 'samples': {}, 'started': time.perf_counter()}
+        ident = threading.get_ident()
+        with self.lock:
+            self.profiles[trace_id] = profile
+            self.threads[ident] = [profile, current_stage.get()]
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.profiles.pop(trace_id, None)
+                self.threads.pop(ident, None)
+            elapsed = time.perf_counter() - profile['started']
+            if elapsed >= self.threshold:
+                self._dump(profile, elapsed)
+    
+    def track(self, func, *args):
+        """Run pool work, sampling this thread if its request is being profiled"""
+        profile = self.profiles.get(current_trace_id.get()) if self.enabled else None
+        if profile is None:
+            return func(*args)
+        
+        ident = threading.get_ident()
+        with self.lock:
+            previous = self.threads.get(ident)
+            self.threads[ident] = [profile, current_stage.get()]
+        try:
+            return func(*args)
+        finally:
+            with self.lock:
+                if previous is None:
+                    self.threads.pop(ident, None)
+                else:
+                    self.threads[ident] = previous
+    
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Attribute samples taken inside the block to a pipeline stage"""
+        token = current_stage.set(name)
+        entry = self.threads.get(threading.get_ident())
+        previous = entry[1] if entry else None
+        if entry:
+            entry[1] = name
+        try:
+            yield
+        finally:
+            current_stage.reset(token)
+            if entry:
+                entry[1] = previous
+    
+    def _ensure_sampler(self):
+        with self.lock:
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self._sample_loop, name='profiler', daemon=True)
+                self.sampler.start()
+    
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                targets = [(ident, entry[0], entry[1]) for ident, entry in self.threads.items()]
+            if not targets:
+                continue
+            
+            frames = sys._current_frames()
+            stacks = []
+            for ident, profile, stage in targets:
+                frame = frames.get(ident)
+                if frame is not None:
+                    stacks.append((profile, ";".join(
+                        [f"session:{profile['session_id'][:8]}", f"stage:{stage}"] + self._collapse(frame)
+                    )))
+            del frames
+            
+            with self.lock:
+                for profile, stack in stacks:
+                    samples = profile['samples']
+                    samples[stack] = samples.get(stack, 0) + 1
+    
+    @staticmethod
+    def _collapse(frame):
+        """Function names from the outermost frame inwards"""
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        names.reverse()
+        return names
+    
+    def _dump(self, profile, elapsed):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(
+                self.directory,
+                f"{time.strftime('%Y%m%d-%H%M%S')}-{profile['session_id'][:8]}-{profile['trace_id']}.collapsed"
+            )
+            with self.lock:
+                samples = dict(profile['samples'])
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in sorted(samples.items()):
+                    f.write(f"{stack} {count}\n")
+            self.logger.warning(
+                f"Slow request took {elapsed:.1f}s; wrote {sum(samples.values())} stack samples to {path}"
+            )
+        except Exception as e:
+            self.logger.error(f"Failed to write profile: {str(e)}")
+
+profiler = SlowRequestProfiler()
+
+class LRUCache:
+    """Thread-safe, memory-bounded LRU cache with per-entry TTL"""
+    
+    def __init__(self, max_bytes, default_ttl, name='cache'):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.name = name
+        self.entries = OrderedDict()  # key -> (value, size, expires_at)
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    def get(self, key):
+        """Return the cached value, or None if missing or expired"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            value, size, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                self.current_bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def set(self, key, value, ttl=None, size=None):
+        """Store a value, evicting least recently used entries to stay in budget"""
+        size = size if size is not None else sys.getsizeof(key) + sys.getsizeof(value)
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + (ttl if ttl is not None else self.default_ttl)
+        
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous[1]
+            
+            self.entries[key] = (value, size, expires_at)
+            self.current_bytes += size
+            
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self.entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+    
+    def delete(self, key):
+        """Drop an entry if present"""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.current_bytes -= entry[1]
+    
+    def stats(self):
+        """Hit, miss and eviction counters plus current usage"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+class SingleFlight:
+    """Lets concurrent callers with the same key share one in-flight operation
+    
+    The first caller (the leader) runs the operation; callers arriving while
+    it is running wait for its result, or its exception, instead of repeating it.
+    """
+    
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.async_calls = {}
+        self.leaders = 0
+        self.waiters = 0
+    
+    def do(self, key, func, *args):
+        """Run func(*args) unless the same key is already in flight on a thread"""
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+                self.leaders += 1
+            else:
+                self.waiters += 1
+        
+        if not leader:
+            return future.result()
+        try:
+            result = func(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+    
+    async def do_async(self, key, func, *args):
+        """Await func(*args) unless the same key is already in flight on the event loop"""
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            future = self.async_calls.get(key)
+            leader = future is None or future.get_loop() is not loop
+            if leader:
+                future = self.async_calls[key] = loop.create_future()
+                self.leaders += 1
+            else:
+                self.waiters += 1
+        
+        if not leader:
+            return await asyncio.shield(future)
+        try:
+            result = await func(*args)
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                # Waiters were not cancelled themselves; they see a failed call instead
+                e = RuntimeError(f"Shared {self.name} call was cancelled")
+            future.set_exception(e)
+            future.exception()  # retrieved here, so unawaited failures are not reported
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                if self.async_calls.get(key) is future:
+                    del self.async_calls[key]
+    
+    def stats(self):
+        """Leader and waiter counts; the ratio is the share of calls that were coalesced"""
+        with self.lock:
+            total = self.leaders + self.waiters
+            return {
+                'leaders': self.leaders,
+                'waiters': self.waiters,
+                'in_flight': len(self.calls) + len(self.async_calls),
+                'coalescing_ratio': self.waiters / total if total else 0.0
+            }
+
+class WebCache:
+    """Two-tier cache for search results and page text: in-memory LRU over SQLite
+    
+    Entries carry their own freshness deadline plus the ETag/Last-Modified
+    validators of the response they came from, so stale entries can be
+    revalidated with a conditional request instead of being refetched.
+    """
+    
+    def __init__(self, path=None, memory_bytes=None):
+        self.logger = logging.getLogger('WebCache')
+        self.path = path or Config.WEB_CACHE_PATH
+        self.memory = LRUCache(
+            memory_bytes or Config.WEB_CACHE_MEMORY_BYTES, Config.WEB_CACHE_STALE_TTL, name='web'
+        )
+        self.lock = threading.Lock()
+        self.disk_hits = 0
+        self.revalidations = 0
+        self.writes_since_purge = 0
+        
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS web_cache (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (kind, key)
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS web_cache_expires_at ON web_cache (expires_at)")
+        self.purge()
+    
+    def get(self, kind, key):
+        """Return the entry (fresh or stale) with a 'fresh' flag, or None"""
+        memory_key = (kind, key)
+        entry = self.memory.get(memory_key)
+        
+        if entry is None:
+            with self.lock:
+                row = self.db.execute(
+                    "SELECT value, etag, last_modified, expires_at FROM web_cache WHERE kind = ? AND key = ?",
+                    (kind, key)
+                ).fetchone()
+            if row is None:
+                return None
+            
+            value, etag, last_modified, expires_at = row
+            entry = {
+                'value': json.loads(zlib.decompress(value)),
+                'etag': etag,
+                'last_modified': last_modified,
+                'expires_at': expires_at
+            }
+            self.memory.set(memory_key, entry, size=len(value) * 4)
+            with self.lock:
+                self.disk_hits += 1
+        
+        return dict(entry, fresh=entry['expires_at'] > time.time())
+    
+    def put(self, kind, key, value, ttl, etag=None, last_modified=None):
+        """Store a value in both tiers"""
+        expires_at = time.time() + ttl
+        blob = zlib.compress(json.dumps(value).encode('utf-8'))
+        entry = {'value': value, 'etag': etag, 'last_modified': last_modified, 'expires_at': expires_at}
+        self.memory.set((kind, key), entry, size=len(blob) * 4)
+        
+        try:
+            with self.lock, self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO web_cache VALUES (?, ?, ?, ?, ?, ?)",
+                    (kind, key, blob, etag, last_modified, expires_at)
+                )
+                self.writes_since_purge += 1
+                purge_due = self.writes_since_purge >= Config.WEB_CACHE_PURGE_EVERY
+        except sqlite3.Error as e:
+            self.logger.warning(f"Failed to persist cache entry: {str(e)}")
+            return
+        
+        # Long-running processes would otherwise only shed stale rows on restart
+        if purge_due:
+            self.purge()
+    
+    def refresh(self, kind, key, ttl):
+        """Extend an entry's freshness after a successful revalidation"""
+        expires_at = time.time() + ttl
+        entry = self.memory.get((kind, key))
+        if entry is not None:
+            self.memory.set((kind, key), dict(entry, expires_at=expires_at))
+        
+        try:
+            with self.lock, self.db:
+                self.db.execute(
+                    "UPDATE web_cache SET expires_at = ? WHERE kind = ? AND key = ?",
+                    (expires_at, kind, key)
+                )
+                self.revalidations += 1
+        except sqlite3.Error as e:
+            self.logger.warning(f"Failed to refresh cache entry: {str(e)}")
+    
+    def purge(self):
+        """Drop entries that have been stale for longer than the revalidation window"""
+        try:
+            with self.lock, self.db:
+                self.db.execute(
+                    "DELETE FROM web_cache WHERE expires_at < ?",
+                    (time.time() - Config.WEB_CACHE_STALE_TTL,)
+                )
+                self.writes_since_purge = 0
+        except sqlite3.Error as e:
+            self.logger.warning(f"Failed to purge web cache: {str(e)}")
+    
+    @staticmethod
+    def conditional_headers(entry):
+        """Validators to send when revalidating a stale entry"""
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+    
+    def stats(self):
+        """Memory tier statistics plus disk hits and revalidations"""
+        with self.lock:
+            return dict(self.memory.stats(), disk_hits=self.disk_hits, revalidations=self.revalidations)
+
+# Elements whose text never counts as page content
+HTML_SKIP_TAGS = ['script', 'style', 'nav', 'footer', 'header', 'aside']
+# Main content containers, most specific first
+HTML_CONTENT_SELECTORS = [
+    'article', 'main', '.content', '.post-content',
+    '.entry-content', '.article-body', '#content'
+]
+
+class SoupExtractor:
+    """Reference HTML extractor built on BeautifulSoup's html.parser"""
+    
+    name = "soup"
+    
+    # Only the tags holding result links are parsed on search pages. Classes
+    # are matched afterwards by find_all, since a strainer compares the whole
+    # class attribute and would drop elements carrying several classes
+    SEARCH_STRAINERS = {
+        'google.com': 'div',
+        'duckduckgo.com': 'a',
+        'bing.com': 'h2',
+    }
+    
+    def extract_content(self, html):
+        """Pick the main content out of a page's HTML"""
+        soup = bs4.BeautifulSoup(html, 'html.parser')
+        
+        # Remove unwanted elements
+        for element in soup(HTML_SKIP_TAGS):
+            element.decompose()
+        
+        # Try to find main content
+        content = ""
+        for selector in HTML_CONTENT_SELECTORS:
+            elements = soup.select(selector)
+            if elements:
+                content = elements[0].get_text(strip=True, separator=' ')
+                break
+        
+        # Fallback to body content
+        if not content:
+            body = soup.find('body')
+            if body:
+                content = body.get_text(strip=True, separator=' ')
+        
+        # Clean and truncate content
+        content = re.sub(r'\s+', ' ', content)
+        return content[:Config.MAX_CONTENT_LENGTH]
+    
+    def content_parser(self, encoding=None):
+        """Incremental parser interface; BeautifulSoup needs the whole document"""
+        return BufferedContentParser(self, encoding)
+    
+    def extract_search_results(self, html, search_engine):
+        """Extract search results from search engine HTML"""
+        results = []
+        strainer = next((bs4.SoupStrainer(tag) for domain, tag in self.SEARCH_STRAINERS.items()
+                         if domain in search_engine), None)
+        soup = bs4.BeautifulSoup(html, 'html.parser', parse_only=strainer)
+        
+        if 'google.com' in search_engine:
+            # Google search results
+            for result in soup.find_all('div', class_='g')[:5]:
+                title_elem = result.find('h3')
+                link_elem = result.find('a')
+                
+                if title_elem and link_elem:
+                    title = title_elem.get_text(strip=True)
+                    url = link_elem.get('href')
+                    
+                    if url and not url.startswith('/'):
+                        results.append({'title': title, 'url': url})
+                        
+        elif 'duckduckgo.com' in search_engine:
+            # DuckDuckGo search results
+            for result in soup.find_all('a', class_='result__a')[:5]:
+                title = result.get_text(strip=True)
+                url = result.get('href')
+                
+                if title and url:
+                    results.append({'title': title, 'url': url})
+                    
+        elif 'bing.com' in search_engine:
+            # Bing search results
+            for result in soup.find_all('h2')[:5]:
+                link_elem = result.find('a')
+                if link_elem:
+                    title = link_elem.get_text(strip=True)
+                    url = link_elem.get('href')
+                    
+                    if title and url:
+                        results.append({'title': title, 'url': url})
+        
+        return results
+
+class BufferedContentParser:
+    """Collects streamed bytes and extracts content once the download ends"""
+    
+    done = False
+    
+    def __init__(self, extractor, encoding=None):
+        self.extractor = extractor
+        self.encoding = encoding or 'utf-8'
+        self.chunks = []
+    
+    @property
+    def has_enough_text(self):
+        return False
+    
+    def feed(self, data):
+        self.chunks.append(data)
+    
+    def close(self):
+        html = b''.join(self.chunks).decode(self.encoding, errors='replace')
+        return self.extractor.extract_content(html)
+
+class _ContentTarget:
+    """lxml parser target that collects main-content text without building a tree
+    
+    Text inside skipped tags is never collected, so whole subtrees are
+    ignored instead of being decomposed. Parsing is finished as soon as
+    the highest-priority content container closes.
+    """
+    
+    def __init__(self):
+        self.skip_depth = 0
+        self.in_body = False
+        self.open_candidates = []  # [tag, priority, nested same-name tags] for containers currently open
+        self.captures = {}  # priority -> collected strings, first match only
+        self.completed = set()
+        self.body_text = []
+        self.pending = []
+        self.done = False
+    
+    def _priority(self, tag, attrib):
+        classes = attrib.get('class', '').split()
+        for priority, selector in enumerate(HTML_CONTENT_SELECTORS):
+            if selector.startswith('.'):
+                matched = selector[1:] in classes
+            elif selector.startswith('#'):
+                matched = attrib.get('id') == selector[1:]
+            else:
+                matched = tag == selector
+            if matched:
+                return priority
+        return None
+    
+    def _flush(self):
+        if not self.pending:
+            return
+        text = ''.join(self.pending).strip()
+        self.pending = []
+        if not text or self.skip_depth:
+            return
+        if self.in_body:
+            self.body_text.append(text)
+        for _, priority, _ in self.open_candidates:
+            self.captures[priority].append(text)
+    
+    def start(self, tag, attrib):
+        if self.done:
+            return
+        self._flush()
+        if self.skip_depth or tag in HTML_SKIP_TAGS:
+            self.skip_depth += 1
+            return
+        if tag == 'body':
+            self.in_body = True
+        for candidate in self.open_candidates:
+            if candidate[0] == tag:
+                candidate[2] += 1
+        priority = self._priority(tag, attrib)
+        if priority is not None and priority not in self.captures:
+            self.captures[priority] = []
+            self.open_candidates.append([tag, priority, 0])
+    
+    def end(self, tag):
+        if self.done:
+            return
+        self._flush()
+        if self.skip_depth:
+            self.skip_depth -= 1
+            return
+        same_name = [candidate for candidate in self.open_candidates if candidate[0] == tag]
+        if not same_name:
+            return
+        closing = same_name[-1] if not same_name[-1][2] else None
+        # Outer containers with this tag name counted the closing element as nested
+        for candidate in same_name:
+            if candidate is not closing:
+                candidate[2] -= 1
+        if closing is None:
+            return
+        self.open_candidates.remove(closing)
+        priority = closing[1]
+        self.completed.add(priority)
+        # Nothing can outrank the first selector, so stop reading here
+        if priority == 0 and self.captures[priority]:
+            self.done = True
+    
+    def data(self, data):
+        if not self.done and not self.skip_depth:
+            self.pending.append(data)
+    
+    def close(self):
+        self._flush()
+        return self.result()
+    
+    def text_length(self):
+        """Characters collected by the best container seen so far"""
+        for priority in sorted(self.captures):
+            if self.captures[priority]:
+                return sum(len(text) + 1 for text in self.captures[priority])
+        return 0
+    
+    def result(self):
+        """Text of the best matching container, or of the body as a fallback"""
+        content = ""
+        for priority in sorted(self.captures):
+            if self.captures[priority]:
+                content = ' '.join(self.captures[priority])
+                break
+        if not content:
+            content = ' '.join(self.body_text)
+        
+        content = re.sub(r'\s+', ' ', content)
+        return content[:Config.MAX_CONTENT_LENGTH]
+
+class StreamingContentParser:
+    """Incremental main-content extraction on top of lxml's push parser"""
+    
+    def __init__(self, encoding=None):
+        try:
+            encoding = codecs.lookup(encoding).name if encoding else None
+        except LookupError:
+            encoding = None  # let libxml2 sniff the document instead
+        self.target = _ContentTarget()
+        self.parser = lxml_etree.HTMLParser(target=self.target, encoding=encoding)
+        self.holdback = None
+    
+    @property
+    def done(self):
+        return self.target.done
+    
+    @property
+    def has_enough_text(self):
+        """True once a content container holds a full answer's worth of text"""
+        return self.target.text_length() >= Config.MAX_CONTENT_LENGTH
+    
+    def feed(self, data):
+        """Feed the next chunk of markup; tags are never split across feeds"""
+        if self.done:
+            return
+        if self.holdback:
+            data = self.holdback + data
+        # libxml2 mis-parses end tags split between pushes, so hold back the last tag
+        cut = data.rfind('<' if isinstance(data, str) else b'<')
+        if cut > 0:
+            self.parser.feed(data[:cut])
+            self.holdback = data[cut:]
+        else:
+            self.holdback = data
+    
+    def close(self):
+        """Finish parsing and return the extracted text"""
+        if not self.done and self.holdback:
+            self.parser.feed(self.holdback)
+        self.holdback = None
+        try:
+            self.parser.close()
+        except lxml_etree.XMLSyntaxError:
+            pass
+        return self.target.result()
+
+class LxmlExtractor:
+    """Fast HTML extractor: streaming lxml parse for pages, XPath for search results"""
+    
+    name = "lxml"
+    
+    GOOGLE_RESULTS = "//div[contains(concat(' ', normalize-space(@class), ' '), ' g ')]"
+    DUCKDUCKGO_RESULTS = "//a[contains(concat(' ', normalize-space(@class), ' '), ' result__a ')]"
+    
+    def content_parser(self, encoding=None):
+        """Parser that accepts the page a chunk at a time"""
+        return StreamingContentParser(encoding)
+    
+    def extract_content(self, html):
+        """Pick the main content out of a page's HTML"""
+        parser = StreamingContentParser()
+        parser.feed(html)
+        return parser.close()
+    
+    @staticmethod
+    def _text(element):
+        return ''.join(text.strip() for text in element.itertext())
+    
+    def extract_search_results(self, html, search_engine):
+        """Extract search results from search engine HTML"""
+        results = []
+        if not html.strip():
+            return results
+        tree = lxml_html.fromstring(html)
+        
+        if 'google.com' in search_engine:
+            for result in tree.xpath(self.GOOGLE_RESULTS)[:5]:
+                title_elem = next(iter(result.iter('h3')), None)
+                link_elem = next(iter(result.iter('a')), None)
+                
+                if title_elem is not None and link_elem is not None:
+                    url = link_elem.get('href')
+                    if url and not url.startswith('/'):
+                        results.append({'title': self._text(title_elem), 'url': url})
+                        
+        elif 'duckduckgo.com' in search_engine:
+            for result in tree.xpath(self.DUCKDUCKGO_RESULTS)[:5]:
+                title = self._text(result)
+                url = result.get('href')
+                if title and url:
+                    results.append({'title': title, 'url': url})
+                    
+        elif 'bing.com' in search_engine:
+            for result in tree.iter('h2'):
+                if len(results) >= 5:
+                    break
+                link_elem = next(iter(result.iter('a')), None)
+                if link_elem is not None:
+                    title = self._text(link_elem)
+                    url = link_elem.get('href')
+                    if title and url:
+                        results.append({'title': title, 'url': url})
+        
+        return results
+
+HTML_EXTRACTORS = {
+    SoupExtractor.name: SoupExtractor,
+    LxmlExtractor.name: LxmlExtractor,
+}
+
+def get_html_extractor(name=None):
+    """Instantiate the configured extractor, falling back to BeautifulSoup without lxml"""
+    name = name or Config.HTML_EXTRACTOR
+    if name == LxmlExtractor.name and lxml_etree is None:
+        logging.getLogger('WebScraper').warning("lxml is not installed; using the soup extractor")
+        name = SoupExtractor.name
+    return HTML_EXTRACTORS[name]()
+
+class SearchFanout:
+    """Bookkeeping for one multi-query search, independent of how requests are run
+    
+    Engine results from each query feed page fetches until that query's
+    result budget is used up; finished pages are returned in engine and
+    rank order regardless of completion order.
+    """
+    
+    def __init__(self, queries):
+        self.queries = queries
+        self.collected = [[] for _ in queries]
+        self.scheduled = [0] * len(queries)
+        self.seen_urls = [set() for _ in queries]
+    
+    def engine_requests(self):
+        """(search_url, tag) for every engine query of every search"""
+        for index, (query, _) in enumerate(self.queries):
+            encoded_query = quote_plus(query)
+            for engine_index, search_engine in enumerate(Config.WEB_SEARCH_ENGINES[:2]):  # Use first 2 engines
+                yield search_engine.format(query=encoded_query), (index, engine_index, search_engine, query)
+    
+    def page_requests(self, tag, search_results):
+        """(url, tag) for the pages still needed from one engine's results"""
+        index, engine_index = tag[0], tag[1]
+        max_results = self.queries[index][1]
+        for rank, search_result in enumerate(search_results):
+            if self.scheduled[index] >= max_results:
+                break
+            if search_result['url'] in self.seen_urls[index]:
+                continue
+            self.seen_urls[index].add(search_result['url'])
+            self.scheduled[index] += 1
+            yield search_result['url'], (index, (engine_index, rank), search_result)
+    
+    def add_page(self, tag, content):
+        """Record the extracted text of a fetched page"""
+        index, order, search_result = tag
+        if content:
+            self.collected[index].append((order, {
+                'title': search_result['title'],
+                'url': search_result['url'],
+                'content': content[:Config.MAX_CONTENT_LENGTH]
+            }))
+    
+    def results(self):
+        """Content per query, in engine and rank order"""
+        return [[item for _, item in sorted(results, key=lambda entry: entry[0])]
+                for results in self.collected]
+
+class WebScraper:
+    """Advanced web scraping with intelligent content extraction"""
+    
+    def __init__(self):
+        self.logger = logging.getLogger('WebScraper')
+        self.session = requests.Session()
+        self.headers = {
+            'User-Agent': random.choice(Config.USER_AGENTS),
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+            'Accept-Language': 'en-US,en;q=0.5',
+            'Accept-Encoding': 'gzip, deflate',
+            'DNT': '1',
+            'Connection': 'keep-alive',
+            'Upgrade-Insecure-Requests': '1',
+        }
+        self.session.headers.update(self.headers)
+        
+        # Size the connection pool to match the number of concurrent fetches
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=Config.SEARCH_MAX_CONCURRENCY,
+            pool_maxsize=Config.SEARCH_MAX_CONCURRENCY
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        
+        # The pool size is the global concurrency cap; hosts get their own slots
+        self.executor = ThreadPoolExecutor(
+            max_workers=Config.SEARCH_MAX_CONCURRENCY, thread_name_prefix='scraper'
+        )
+        self.host_slots = {}
+        self.host_slots_lock = threading.Lock()
+        
+        self.web_cache = WebCache() if Config.WEB_CACHE_ENABLED else None
+        self.extractor = get_html_extractor()
+        self.async_state = None
+        
+        # Concurrent requests for the same search or page share one fetch
+        self.inflight = SingleFlight('fetch')
+    
+    def search_web(self, query, max_results=5, deadline=None):
+        """Perform web search and extract relevant content"""
+        return self.search_many([(query, max_results)], deadline=deadline)[0]
+    
+    def search_many(self, queries, deadline=None, stop=None):
+        """Run several searches concurrently and return content per query
+        
+        Every engine query and page fetch is sent at once, bounded by the
+        global and per-host limits. Whatever has finished when the deadline
+        expires, or when the optional stop future is resolved, is returned;
+        the rest is abandoned.
+        """
+        deadline = deadline or time.monotonic() + Config.SEARCH_DEADLINE
+        fanout = SearchFanout(queries)
+        futures = {}
+        
+        try:
+            # Send every engine query for every search up front
+            for search_url, tag in fanout.engine_requests():
+                self.logger.info(f"Searching: {search_url}")
+                future = self._submit(search_url, deadline, self._search_engine, search_url, tag[2], tag[3])
+                futures[future] = ('search', tag)
+            
+            while futures:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.logger.warning(f"Search deadline reached with {len(futures)} requests pending")
+                    break
+                
+                done, _ = wait([*futures, stop] if stop else futures, timeout=remaining,
+                               return_when=FIRST_COMPLETED)
+                if stop is not None and stop.done():
+                    self.logger.info(f"Search stopped with {len(futures)} requests pending")
+                    break
+                for future in done:
+                    kind, tag = futures.pop(future)
+                    try:
+                        value = future.result()
+                    except Exception as e:
+                        self.logger.warning(f"{'Search engine' if kind == 'search' else 'Page fetch'} failed: {str(e)}")
+                        continue
+                    
+                    if kind == 'search':
+                        # Fetch pages from this engine as soon as its results arrive
+                        for url, page_tag in fanout.page_requests(tag, value):
+                            futures[self._submit(url, deadline, self._extract_page_content, url)] = ('page', page_tag)
+                    else:
+                        fanout.add_page(tag, value)
+        except Exception as e:
+            self.logger.error(f"Web search failed: {str(e)}")
+        finally:
+            for future in futures:
+                future.cancel()
+        
+        return fanout.results()
+    
+    async def search_many_async(self, queries, deadline=None):
+        """Event loop counterpart of search_many with the same limits and deadline"""
+        if httpx is None:
+            # Without an async HTTP client the thread pool version runs off the event loop
+            return await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(
+                    contextvars.copy_context().run, self.search_many, queries, deadline
+                )
+            )
+        
+        deadline = deadline or time.monotonic() + Config.SEARCH_DEADLINE
+        fanout = SearchFanout(queries)
+        tasks = {}
+        
+        try:
+            for search_url, tag in fanout.engine_requests():
+                self.logger.info(f"Searching: {search_url}")
+                task = asyncio.ensure_future(self._run_with_host_slot_async(
+                    search_url, deadline, self._search_engine_async, search_url, tag[2], tag[3]
+                ))
+                tasks[task] = ('search', tag)
+            
+            while tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.logger.warning(f"Search deadline reached with {len(tasks)} requests pending")
+                    break
+                
+                done, _ = await asyncio.wait(tasks, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    kind, tag = tasks.pop(task)
+                    try:
+                        value = task.result()
+                    except Exception as e:
+                        self.logger.warning(f"{'Search engine' if kind == 'search' else 'Page fetch'} failed: {str(e)}")
+                        continue
+                    
+                    if kind == 'search':
+                        for url, page_tag in fanout.page_requests(tag, value):
+                            page_task = asyncio.ensure_future(self._run_with_host_slot_async(
+                                url, deadline, self._extract_page_content_async, url
+                            ))
+                            tasks[page_task] = ('page', page_tag)
+                    else:
+                        fanout.add_page(tag, value)
+        except Exception as e:
+            self.logger.error(f"Web search failed: {str(e)}")
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        return fanout.results()
+    
+    def _submit(self, url, deadline, func, *args):
+        """Schedule a request on the shared pool, respecting the per-host limit"""
+        if Config.COALESCE_FETCHES:
+            return submit_in_context(
+                self.executor,
+                self.inflight.do, (func.__name__, url), self._run_with_host_slot, url, deadline, func, *args
+            )
+        return submit_in_context(self.executor, self._run_with_host_slot, url, deadline, func, *args)
+    
+    def _run_with_host_slot(self, url, deadline, func, *args):
+        """Hold one of the host's slots for the duration of the request"""
+        host = urlparse(url).netloc
+        with self.host_slots_lock:
+            slot = self.host_slots.get(host)
+            if slot is None:
+                slot = self.host_slots[host] = threading.BoundedSemaphore(Config.SEARCH_PER_HOST_LIMIT)
+        
+        if not slot.acquire(timeout=max(0, deadline - time.monotonic())):
+            raise TimeoutError(f"Timed out waiting for a connection slot to {host}")
+        try:
+            return func(*args)
+        finally:
+            slot.release()
+    
+    def _get_async_state(self):
+        """httpx client and semaphores bound to the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self.async_state is None or self.async_state['loop'] is not loop:
+            self.async_state = {
+                'loop': loop,
+                'client': httpx.AsyncClient(
+                    headers=self.headers, follow_redirects=True, timeout=Config.SEARCH_REQUEST_TIMEOUT,
+                    limits=httpx.Limits(max_connections=Config.SEARCH_MAX_CONCURRENCY)
+                ),
+                'global_slots': asyncio.Semaphore(Config.SEARCH_MAX_CONCURRENCY),
+                'host_slots': {}
+            }
+        return self.async_state
+    
+    async def _run_with_host_slot_async(self, url, deadline, func, *args):
+        """Hold a global and a per-host slot for the duration of the request"""
+        if Config.COALESCE_FETCHES:
+            return await self.inflight.do_async(
+                (func.__name__, url), self._hold_slots_async, url, deadline, func, *args
+            )
+        return await self._hold_slots_async(url, deadline, func, *args)
+    
+    async def _hold_slots_async(self, url, deadline, func, *args):
+        """Acquire the slots and run the request"""
+        state = self._get_async_state()
+        host = urlparse(url).netloc
+        slot = state['host_slots'].setdefault(host, asyncio.Semaphore(Config.SEARCH_PER_HOST_LIMIT))
+        
+        try:
+            await asyncio.wait_for(slot.acquire(), timeout=max(0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Timed out waiting for a connection slot to {host}")
+        try:
+            async with state['global_slots']:
+                return await func(*args)
+        finally:
+            slot.release()
+    
+    async def aclose(self):
+        """Close the async client when the event loop shuts down"""
+        if self.async_state is not None:
+            await self.async_state['client'].aclose()
+            self.async_state = None
+    
+    @tracer.traced('web', 'search_engine')
+    def _search_engine(self, search_url, search_engine, query):
+        """Query a single search engine and parse its result links"""
+        cache_key = f"{urlparse(search_engine).netloc}\n{self._normalize_query(query)}"
+        cached = self.web_cache.get('search', cache_key) if self.web_cache else None
+        if cached and cached['fresh']:
+            tracer.note(cache='hit')
+            return cached['value']
+        
+        response = self.session.get(
+            search_url, timeout=Config.SEARCH_REQUEST_TIMEOUT, headers=WebCache.conditional_headers(cached)
+        )
+        tracer.note(cache='miss', bytes_in=len(response.content))
+        if response.status_code == 304 and cached:
+            tracer.note(cache='revalidated')
+            self.web_cache.refresh('search', cache_key, Config.SEARCH_CACHE_TTL)
+            return cached['value']
+        if response.status_code == 200:
+            results = self._extract_search_results(response.text, search_engine)
+            self._cache_response('search', cache_key, results, Config.SEARCH_CACHE_TTL, response)
+            return results
+        return []
+    
+    async def _off_loop(self, func, *args):
+        """Run blocking work (SQLite cache I/O, parsing) on the scraper's pool"""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, contextvars.copy_context().run, func, *args
+        )
+    
+    @tracer.traced('web', 'search_engine')
+    async def _search_engine_async(self, search_url, search_engine, query):
+        """Event loop counterpart of _search_engine"""
+        cache_key = f"{urlparse(search_engine).netloc}\n{self._normalize_query(query)}"
+        cached = await self._off_loop(self.web_cache.get, 'search', cache_key) if self.web_cache else None
+        if cached and cached['fresh']:
+            tracer.note(cache='hit')
+            return cached['value']
+        
+        client = self._get_async_state()['client']
+        response = await client.get(search_url, headers=WebCache.conditional_headers(cached))
+        tracer.note(cache='miss', bytes_in=len(response.content))
+        if response.status_code == 304 and cached:
+            tracer.note(cache='revalidated')
+            await self._off_loop(self.web_cache.refresh, 'search', cache_key, Config.SEARCH_CACHE_TTL)
+            return cached['value']
+        if response.status_code == 200:
+            # Parsing is CPU work, so keep it off the event loop
+            results = await self._off_loop(self._extract_search_results, response.text, search_engine)
+            await self._off_loop(
+                self._cache_response, 'search', cache_key, results, Config.SEARCH_CACHE_TTL, response
+            )
+            return results
+        return []
+    
+    @staticmethod
+    def _normalize_query(query):
+        """Canonical form of a query for cache lookups"""
+        return re.sub(r'\s+', ' ', query).strip().lower()
+    
+    def _cache_response(self, kind, key, value, ttl, response):
+        """Remember a parsed response along with its revalidation headers"""
+        if self.web_cache:
+            self.web_cache.put(
+                kind, key, value, ttl,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified')
+            )
+    
+    def _extract_search_results(self, html, search_engine):
+        """Extract search results from search engine HTML"""
+        try:
+            return self.extractor.extract_search_results(html, search_engine)
+        except Exception as e:
+            self.logger.warning(f"Failed to extract search results: {str(e)}")
+            return []
+    
+    @tracer.traced('web', 'page_fetch')
+    def _extract_page_content(self, url):
+        """Extract main content from a webpage"""
+        cached = self.web_cache.get('page', url) if self.web_cache else None
+        if cached and cached['fresh']:
+            tracer.note(cache='hit')
+            return cached['value']
+        tracer.note(cache='miss')
+        
+        try:
+            response = self.session.get(
+                url, timeout=Config.SEARCH_REQUEST_TIMEOUT, headers=WebCache.conditional_headers(cached),
+                stream=True
+            )
+            with response:
+                if response.status_code == 304 and cached:
+                    tracer.note(cache='revalidated')
+                    self.web_cache.refresh('page', url, Config.PAGE_CACHE_TTL)
+                    return cached['value']
+                if response.status_code == 200:
+                    content = self._download_page_content(url, response)
+                    self._cache_response('page', url, content, Config.PAGE_CACHE_TTL, response)
+                    return content
+                
+        except Exception as e:
+            self.logger.warning(f"Failed to extract content from {url}: {str(e)}")
+        
+        return ""
+    
+    @tracer.traced('web', 'page_fetch')
+    async def _extract_page_content_async(self, url):
+        """Event loop counterpart of _extract_page_content"""
+        cached = await self._off_loop(self.web_cache.get, 'page', url) if self.web_cache else None
+        if cached and cached['fresh']:
+            tracer.note(cache='hit')
+            return cached['value']
+        tracer.note(cache='miss')
+        
+        try:
+            client = self._get_async_state()['client']
+            async with client.stream('GET', url, headers=WebCache.conditional_headers(cached)) as response:
+                if response.status_code == 304 and cached:
+                    tracer.note(cache='revalidated')
+                    await self._off_loop(self.web_cache.refresh, 'page', url, Config.PAGE_CACHE_TTL)
+                    return cached['value']
+                if response.status_code == 200:
+                    parser = self._page_parser(url, response.headers)
+                    content = ""
+                    if parser:
+                        received = 0
+                        async for chunk in response.aiter_bytes(Config.PAGE_CHUNK_SIZE):
+                            # Each chunk is parsed on the pool; the loop only moves bytes
+                            received, finished = await self._off_loop(
+                                self._feed_page_chunk, parser, chunk, received
+                            )
+                            if finished:
+                                break
+                        tracer.note(bytes_in=received)
+                        content = await self._off_loop(parser.close)
+                    await self._off_loop(
+                        self._cache_response, 'page', url, content, Config.PAGE_CACHE_TTL, response
+                    )
+                    return content
+                
+        except Exception as e:
+            self.logger.warning(f"Failed to extract content from {url}: {str(e)}")
+        
+        return ""
+    
+    def _download_page_content(self, url, response):
+        """Stream a page through the extractor, stopping once enough text is in
+        
+        Non-HTML responses are rejected from their headers alone, and no more
+        than Config.PAGE_DOWNLOAD_BUDGET bytes are read from any page. Closing
+        the response early drops the connection instead of draining the body.
+        """
+        parser = self._page_parser(url, response.headers)
+        if parser is None:
+            return ""
+        
+        received = 0
+        for chunk in response.iter_content(chunk_size=Config.PAGE_CHUNK_SIZE):
+            received, finished = self._feed_page_chunk(parser, chunk, received)
+            if finished:
+                break
+        tracer.note(bytes_in=received)
+        
+        return parser.close()
+    
+    def _page_parser(self, url, headers):
+        """Incremental parser for an HTML response, or None for other content types"""
+        content_type = headers.get('Content-Type', '')
+        mime_type = content_type.split(';')[0].strip().lower()
+        if mime_type and mime_type not in Config.PAGE_CONTENT_TYPES:
+            self.logger.info(f"Skipping {mime_type} content from {url}")
+            return None
+        
+        content_length = headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > Config.PAGE_DOWNLOAD_BUDGET:
+            self.logger.info(f"Reading only the first {Config.PAGE_DOWNLOAD_BUDGET} of {content_length} bytes from {url}")
+        
+        charset = re.search(r'charset=["\']?([\w.:-]+)', content_type, re.IGNORECASE)
+        return self.extractor.content_parser(charset.group(1) if charset else None)
+    
+    @staticmethod
+    def _feed_page_chunk(parser, chunk, received):
+        """Feed a chunk within the byte budget; returns (bytes received, finished)"""
+        remaining = Config.PAGE_DOWNLOAD_BUDGET - received
+        parser.feed(chunk[:remaining])
+        received += min(len(chunk), remaining)
+        finished = received >= Config.PAGE_DOWNLOAD_BUDGET or parser.done or parser.has_enough_text
+        return received, finished
+    
+class PipelineStage:
+    """A single node in the reasoning pipeline graph
+    
+    'llm' stages turn their inputs into a prompt for the upstream model and
+    'search' stages turn them into web queries. The optional parse hook
+    post-processes the raw result before downstream stages see it.
+    
+    Once an upstream call has fallen back, the pipeline is degraded: optional
+    stages are skipped with their default as output, and stages with a
+    degraded_build use that simpler prompt instead.
+    
+    A stage that produces several values returns a dict and lists the keys
+    it fills in provides; each becomes an input for downstream stages.
+    """
+    
+    def __init__(self, name, build, inputs=(), kind='llm', parse=None,
+                 optional=False, default=None, degraded_build=None, provides=()):
+        self.name = name
+        self.build = build
+        self.inputs = tuple(inputs)
+        self.kind = kind
+        self.parse = parse
+        self.optional = optional
+        self.default = default
+        self.degraded_build = degraded_build
+        self.provides = tuple(provides)
+
+class StageGraphExecutor:
+    """Runs pipeline stages as soon as all of their declared inputs are ready
+    
+    The same graph can be driven by threads (run: the calling thread plus the
+    worker pool for parallel siblings) or by the event loop (run_async); the
+    caller supplies the function that executes a stage.
+    """
+    
+    def __init__(self, max_workers=Config.PIPELINE_MAX_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pipeline')
+        self.logger = logging.getLogger('StageGraphExecutor')
+    
+    def submit(self, func, *args):
+        """Run a side task on the pipeline's worker pool"""
+        return submit_in_context(self.executor, func, *args)
+    
+    @staticmethod
+    def _store(stage, value, results):
+        """Record a finished stage's value and any values it provides"""
+        results[stage.name] = value
+        for name in stage.provides:
+            results[name] = value[name]
+    
+    @staticmethod
+    def _take_ready(pending, results):
+        """Remove and return the pending stages whose inputs are all available"""
+        ready = [stage for stage in pending.values()
+                 if all(name in results for name in stage.inputs)]
+        for stage in ready:
+            del pending[stage.name]
+        return [(stage, {name: results[name] for name in stage.inputs}) for stage in ready]
+    
+    def run(self, stages, initial_values, runner):
+        """Execute the stage graph on worker threads and return every named value"""
+        results = dict(initial_values)
+        pending = {stage.name: stage for stage in stages}
+        running = {}
+        
+        try:
+            while pending or running:
+                ready = self._take_ready(pending, results)
+                if ready:
+                    # Siblings go to the pool while the calling thread runs one stage
+                    # itself, so a request's sequential chain never waits for a
+                    # pool thread held by other requests
+                    stage, kwargs = ready.pop(0)
+                    for sibling, sibling_kwargs in ready:
+                        running[submit_in_context(self.executor, runner, sibling, sibling_kwargs)] = sibling
+                    self._store(stage, runner(stage, kwargs), results)
+                    done = [future for future in running if future.done()]
+                elif running:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                else:
+                    raise ValueError(f"Unresolvable stage dependencies: {sorted(pending)}")
+                
+                for future in done:
+                    self._store(running.pop(future), future.result(), results)
+        finally:
+            for future in running:
+                future.cancel()
+        
+        return results
+    
+    async def run_async(self, stages, initial_values, runner):
+        """Execute the stage graph as event loop tasks and return every named value"""
+        results = dict(initial_values)
+        pending = {stage.name: stage for stage in stages}
+        running = {}
+        
+        try:
+            while pending or running:
+                for stage, kwargs in self._take_ready(pending, results):
+                    running[asyncio.ensure_future(runner(stage, kwargs))] = stage
+                
+                if not running:
+                    raise ValueError(f"Unresolvable stage dependencies: {sorted(pending)}")
+                
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    self._store(running.pop(task), task.result(), results)
+        finally:
+            for task in running:
+                task.cancel()
+        
+        return results
 
-class WebScraper:
-    """Advanced web scraping with intelligent content extraction"""
+class QueryPlanner:
+    """Turns stage 3/4 output into a small set of distinct, searchable queries"""
+    
+    STOPWORDS = frozenset("""
+        a an and are as at be by for from how in is it of on or that the this to
+        what when where which who why with about into vs versus
+    """.split())
+    FRAGMENT_PREFIXES = ('and ', 'or ', 'but ', 'with ', 'which ', 'that ')
     
     def __init__(self):
-        self.logger = logging.getLogger('WebScraper')
-        self.session = requests.Session()
-        self.headers = {
-            'User-Agent': random.choice(Config.USER_AGENTS),
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate',
-            'DNT': '1',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-        }
-        self.session.headers.update(self.headers)
+        self.logger = logging.getLogger('QueryPlanner')
     
-    def search_web(self, query, max_results=5):
-        """Perform web search and extract relevant content"""
-        try:
-            search_results = []
-            
-            # Encode query for URL
-            encoded_query = quote_plus(query)
-            
-            # Try different search engines
-            for search_engine in Config.WEB_SEARCH_ENGINES[:2]:  # Use first 2 engines
-                try:
-                    search_url = search_engine.format(query=encoded_query)
-                    self.logger.info(f"Searching: {search_url}")
-                    
-                    response = self.session.get(search_url, timeout=10)
-                    if response.status_code == 200:
-                        results = self._extract_search_results(response.text, search_engine)
-                        search_results.extend(results)
-                        
-                        if len(search_results) >= max_results:
-                            break
-                            
-                except Exception as e:
-                    self.logger.warning(f"Search engine failed: {str(e)}")
-                    continue
-            
-            # Get content from top results
-            content_results = []
-            for result in search_results[:max_results]:
-                content = self._extract_page_content(result['url'])
-                if content:
-                    content_results.append({
-                        'title': result['title'],
-                        'url': result['url'],
-                        'content': content[:Config.MAX_CONTENT_LENGTH]
-                    })
+    def plan(self, search_prompt, search_topics):
+        """Return [(query, max_results), ...] with duplicates and non-queries removed"""
+        candidates = []
+        if search_prompt and not ChatAPI.is_fallback_text(search_prompt):
+            candidates.append((search_prompt, 3))
+        candidates.extend((topic, 2) for topic in search_topics)
+        
+        planned = []  # [query, max_results, tokens]
+        for raw, max_results in candidates:
+            query = self.normalize(raw)
+            if not query:
+                self.logger.info(f"Dropped non-query: {raw[:60]!r}")
+                continue
             
-            return content_results
+            tokens = self._tokens(query)
+            duplicate = next((entry for entry in planned if self._overlaps(tokens, entry[2])), None)
+            if duplicate:
+                # Merge into the earlier query and let it return a little more instead
+                duplicate[1] = min(duplicate[1] + 1, Config.MAX_WEB_RESULTS)
+                self.logger.info(f"Merged {query!r} into {duplicate[0]!r}")
+                continue
             
+            planned.append([query, max_results, tokens])
+        
+        if len(planned) > Config.SEARCH_MAX_QUERIES:
+            self.logger.info(f"Capped {len(planned)} queries at {Config.SEARCH_MAX_QUERIES}")
+        return [(query, max_results) for query, max_results, _ in planned[:Config.SEARCH_MAX_QUERIES]]
+    
+    def normalize(self, text):
+        """Reduce model output to a single search query, or None if it isn't one"""
+        if not text or ChatAPI.is_fallback_text(text):
+            return None
+        
+        # Only the first non-empty line can be a query; the rest is prose
+        line = next((line for line in text.splitlines() if line.strip()), '')
+        line = re.sub(r'^\s*(?:search query|query|topics?)\s*:\s*', '', line, flags=re.IGNORECASE)
+        line = re.sub(r'[*_#`•>]+', ' ', line)
+        line = re.sub(r'^\s*(?:\d+[.)]|-)\s+', '', line)
+        query = re.sub(r'\s+', ' ', line).strip(' "\'.,;:-')
+        
+        if not query or query.lower().startswith(self.FRAGMENT_PREFIXES):
+            return None
+        
+        words = query.split()
+        if len(words) > Config.SEARCH_QUERY_MAX_WORDS or not self._tokens(query):
+            return None
+        
+        if len(query) > Config.SEARCH_QUERY_MAX_CHARS:
+            query = query[:Config.SEARCH_QUERY_MAX_CHARS].rsplit(' ', 1)[0]
+        return query
+    
+    def similar(self, query, other):
+        """True if two queries are near-duplicates"""
+        return self._overlaps(self._tokens(query), self._tokens(other))
+    
+    def message_query(self, user_message):
+        """A search query made from the opening words of a user message, or None"""
+        words = user_message.split()[:Config.SEARCH_QUERY_MAX_WORDS]
+        return self.normalize(" ".join(words))
+    
+    def _tokens(self, query):
+        """Content words of a query, lightly stemmed"""
+        tokens = set()
+        for word in re.findall(r'[a-z0-9]+', query.lower()):
+            if word in self.STOPWORDS:
+                continue
+            if len(word) > 4 and word.endswith('ies'):
+                word = word[:-3] + 'y'
+            elif len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+                word = word[:-1]
+            tokens.add(word)
+        return frozenset(tokens)
+    
+    def _overlaps(self, tokens, other):
+        """Near-duplicate test: high Jaccard similarity or one query inside another"""
+        if not tokens or not other:
+            return False
+        if tokens <= other or other <= tokens:
+            return True
+        return len(tokens & other) / len(tokens | other) >= Config.SEARCH_QUERY_SIMILARITY
+
+class SpeculativeSearch:
+    """Web search on the raw user message, started while the planning stages run"""
+    
+    def __init__(self, query, max_results):
+        self.query = query
+        self.max_results = max_results
+        self.deadline = time.monotonic() + Config.SEARCH_DEADLINE
+        self.stop = Future()
+        self.future = None
+        self.logger = logging.getLogger('SpeculativeSearch')
+    
+    def start(self, web_scraper, executor):
+        """Run the search on a worker thread"""
+        self.future = executor.submit(
+            web_scraper.search_many, [(self.query, self.max_results)], self.deadline, self.stop
+        )
+        return self
+    
+    def start_async(self, web_scraper):
+        """Run the search as an event loop task"""
+        self.future = asyncio.ensure_future(
+            web_scraper.search_many_async([(self.query, self.max_results)], self.deadline)
+        )
+        return self
+    
+    def done(self):
+        return self.future.done()
+    
+    def cancel(self):
+        """Abandon the search and any page fetches still pending"""
+        if not self.stop.done():
+            self.stop.set_result(True)
+        self.future.cancel()
+    
+    def result(self):
+        """Results for the speculative query, waiting no longer than its deadline"""
+        try:
+            return self.future.result(timeout=max(0, self.deadline - time.monotonic()))[0]
         except Exception as e:
-            self.logger.error(f"Web search failed: {str(e)}")
+            self.logger.warning(f"Speculative search failed: {str(e)}")
             return []
     
-    def _extract_search_results(self, html, search_engine):
-        """Extract search results from search engine HTML"""
-        results = []
+    async def result_async(self):
         try:
-            soup = BeautifulSoup(html, 'html.parser')
-            
-            if 'google.com' in search_engine:
-                # Google search results
-                for result in soup.find_all('div', class_='g')[:5]:
-                    title_elem = result.find('h3')
-                    link_elem = result.find('a')
-                    
-                    if title_elem and link_elem:
-                        title = title_elem.get_text(strip=True)
-                        url = link_elem.get('href')
-                        
-                        if url and not url.startswith('/'):
-                            results.append({'title': title, 'url': url})
-                            
-            elif 'duckduckgo.com' in search_engine:
-                # DuckDuckGo search results
-                for result in soup.find_all('a', class_='result__a')[:5]:
-                    title = result.get_text(strip=True)
-                    url = result.get('href')
-                    
-                    if title and url:
-                        results.append({'title': title, 'url': url})
-                        
-            elif 'bing.com' in search_engine:
-                # Bing search results
-                for result in soup.find_all('h2')[:5]:
-                    link_elem = result.find('a')
-                    if link_elem:
-                        title = link_elem.get_text(strip=True)
-                        url = link_elem.get('href')
-                        
-                        if title and url:
-                            results.append({'title': title, 'url': url})
-            
+            return (await asyncio.wait_for(self.future, max(0, self.deadline - time.monotonic())))[0]
         except Exception as e:
-            self.logger.warning(f"Failed to extract search results: {str(e)}")
+            self.logger.warning(f"Speculative search failed: {str(e)}")
+            return []
+
+class RequestRouter:
+    """Cheap local classifier that picks how much of the pipeline a message needs
+    
+    Profiles: 'direct' answers in one upstream call, 'search' answers from a
+    web search on the message itself, 'full' runs all five stages.
+    """
+    
+    PROFILES = ('direct', 'search', 'full')
+    
+    def __init__(self, routing_table=None):
+        self.routing_table = routing_table or Config.ROUTING_TABLE
+        self.lock = threading.Lock()
+        self.counters = {profile: {'requests': 0, 'upstream_calls': 0, 'total_latency': 0.0}
+                         for profile in self.PROFILES}
+        self.logger = logging.getLogger('RequestRouter')
+    
+    def classify(self, user_message):
+        """Name the category of a message; categories are keys of the routing table"""
+        text = user_message.lower()
+        words = re.findall(r"[\w']+", text)
+        phrase = " ".join(words)
         
-        return results
+        for topic, keywords in Config.TOPIC_KEYWORDS.items():
+            if any(word in text for word in keywords):
+                return topic
+        if any(word in text for word in Config.FRESHNESS_KEYWORDS):
+            return 'freshness'
+        if len(words) <= Config.SMALLTALK_MAX_WORDS and self._is_smalltalk(phrase):
+            return 'smalltalk'
+        if len(words) <= Config.SHORT_QUERY_WORDS:
+            return 'short'
+        return 'default'
     
-    def _extract_page_content(self, url):
-        """Extract main content from a webpage"""
-        try:
-            response = self.session.get(url, timeout=10)
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                # Remove unwanted elements
-                for element in soup(['script', 'style', 'nav', 'footer', 'header', 'aside']):
-                    element.decompose()
-                
-                # Try to find main content
-                content_selectors = [
-                    'article', 'main', '.content', '.post-content', 
-                    '.entry-content', '.article-body', '#content'
-                ]
-                
-                content = ""
-                for selector in content_selectors:
-                    elements = soup.select(selector)
-                    if elements:
-                        content = elements[0].get_text(strip=True, separator=' ')
-                        break
-                
-                # Fallback to body content
-                if not content:
-                    body = soup.find('body')
-                    if body:
-                        content = body.get_text(strip=True, separator=' ')
-                
-                # Clean and truncate content
-                content = re.sub(r'\s+', ' ', content)
-                return content[:Config.MAX_CONTENT_LENGTH]
-                
-        except Exception as e:
-            self.logger.warning(f"Failed to extract content from {url}: {str(e)}")
+    @staticmethod
+    def _is_smalltalk(phrase):
+        """True when the phrase is nothing but smalltalk phrases, e.g. hi, how are you"""
+        if phrase in Config.SMALLTALK_PHRASES:
+            return True
+        # Whatever follows a leading greeting must be smalltalk too
+        return any(phrase.startswith(p + " ") and RequestRouter._is_smalltalk(phrase[len(p) + 1:])
+                   for p in Config.SMALLTALK_PHRASES)
+    
+    def route(self, user_message):
+        """Pick the pipeline profile for a message and log the decision"""
+        if not Config.ROUTING_ENABLED:
+            return 'full'
         
-        return ""
+        category = self.classify(user_message)
+        profile = self.routing_table.get(category, self.routing_table.get('default', 'full'))
+        if profile not in self.PROFILES:
+            self.logger.warning(f"Unknown profile {profile!r} for category {category}; using full")
+            profile = 'full'
+        
+        self.logger.info(f"Routing request ({category}) to {profile} profile: {user_message[:50]}...")
+        return profile
+    
+    def record(self, profile, latency, upstream_calls):
+        with self.lock:
+            counters = self.counters[profile]
+            counters['requests'] += 1
+            counters['upstream_calls'] += upstream_calls
+            counters['total_latency'] += latency
+    
+    def stats(self):
+        """Requests, mean latency and mean upstream calls per profile"""
+        with self.lock:
+            return {
+                profile: {
+                    'requests': c['requests'],
+                    'avg_latency': c['total_latency'] / c['requests'] if c['requests'] else 0.0,
+                    'avg_upstream_calls': c['upstream_calls'] / c['requests'] if c['requests'] else 0.0
+                }
+                for profile, c in self.counters.items()
+            }
 
 class AIReasoningPipeline:
     """Multi-stage AI reasoning and processing pipeline"""
     
-    def __init__(self, chat_api, web_scraper):
+    PLANNER_MODES = ('multi', 'compact')
+    
+    def __init__(self, chat_api, web_scraper, executor=None, router=None):
         self.chat_api = chat_api
         self.web_scraper = web_scraper
+        self.executor = executor or StageGraphExecutor()
+        self.query_planner = QueryPlanner()
+        self.router = router or RequestRouter()
         self.logger = logging.getLogger('AIReasoningPipeline')
     
-    def process_request(self, user_message, session_id, conversation_history):
-        """Execute the complete 5-stage AI reasoning pipeline"""
+    def process_request(self, user_message, session_id, conversation_history, planner=None):
+        """Execute the AI reasoning pipeline at the depth the router picks"""
+        profile, state = self._start_request(user_message, planner)
+        self._start_speculation(profile, user_message, state)
+        
+        def runner(stage, kwargs):
+            return self._run_stage(stage, kwargs, session_id, conversation_history, state)
+        
+        stages = self._build_stages(profile, state['planner'])
+        try:
+            results = self.executor.run(stages, {'user_message': user_message}, runner)
+        finally:
+            self._cancel_speculation(state)
+        return self._finish_request(profile, state, results)
+    
+    async def process_request_async(self, user_message, session_id, conversation_history, planner=None):
+        """Execute the pipeline on the event loop without blocking threads"""
+        profile, state = self._start_request(user_message, planner)
+        self._start_speculation(profile, user_message, state, use_async=True)
+        
+        async def runner(stage, kwargs):
+            return await self._run_stage_async(stage, kwargs, session_id, conversation_history, state)
+        
+        stages = self._build_stages(profile, state['planner'])
+        try:
+            results = await self.executor.run_async(stages, {'user_message': user_message}, runner)
+        finally:
+            self._cancel_speculation(state)
+        return self._finish_request(profile, state, results)
+    
+    def process_request_stream(self, user_message, session_id, conversation_history, planner=None):
+        """Run the planning stages, then stream the final response as it is generated
         
-        # Stage 1: Think and Plan
-        thinking_result = self._stage_1_think_and_plan(user_message, session_id, conversation_history)
+        Yields ('thinking', summary) once planning is done if the profile
+        produced a summary, followed by ('token', text) for every chunk of the
+        final answer.
+        """
+        profile, state = self._start_request(user_message, planner)
+        self._start_speculation(profile, user_message, state)
         
-        # Stage 2: Summarize Thinking
-        summary_result = self._stage_2_summarize_thinking(thinking_result, session_id, conversation_history)
+        def runner(stage, kwargs):
+            return self._run_stage(stage, kwargs, session_id, conversation_history, state)
         
-        # Stage 3: Generate Search Prompt
-        search_prompt = self._stage_3_generate_search_prompt(summary_result, session_id, conversation_history)
+        stages = self._build_stages(profile, state['planner'])
+        final_stage = next(stage for stage in stages if stage.name == 'final_response')
+        stages.remove(final_stage)
         
-        # Stage 4: Generate Search Topics
-        search_topics = self._stage_4_generate_search_topics(summary_result, session_id, conversation_history)
+        try:
+            results = self.executor.run(stages, {'user_message': user_message}, runner)
+        finally:
+            self._cancel_speculation(state)
+        if results.get('summary'):
+            yield 'thinking', results['summary']
         
-        # Stage 5: Web Search and Final Response
-        final_response = self._stage_5_final_response(
-            user_message, summary_result, search_prompt, search_topics, session_id, conversation_history
+        _, final_prompt = self._prepare_stage(
+            final_stage, {name: results[name] for name in final_stage.inputs}, state
         )
+        state['upstream_calls'] += 1
+        for chunk in self.chat_api.stream_request(
+            final_prompt, conversation_history, session_id, stage=final_stage.name
+        ):
+            yield 'token', chunk
+        elapsed = time.perf_counter() - state['started']
+        self.router.record(profile, elapsed, state['upstream_calls'])
+        tracer.observe('pipeline', profile, elapsed)
+    
+    def _start_request(self, user_message, planner=None):
+        """Route a message and create its per-request state"""
+        profile = self.router.route(user_message)
+        planner = planner if planner in self.PLANNER_MODES else Config.PLANNER_MODE
+        return profile, {
+            'degraded': False, 'upstream_calls': 0, 'started': time.perf_counter(), 'planner': planner,
+            'lock': threading.Lock()  # independent stages settle from different threads
+        }
+    
+    def _start_speculation(self, profile, user_message, state, use_async=False):
+        """Begin searching the user's own words before the planner has produced queries"""
+        if not Config.SPECULATIVE_SEARCH or profile != 'full':
+            return
+        query = self.query_planner.message_query(user_message)
+        if not query:
+            return
+        
+        speculation = SpeculativeSearch(query, Config.SPECULATIVE_SEARCH_RESULTS)
+        if use_async:
+            state['speculation'] = speculation.start_async(self.web_scraper)
+        else:
+            state['speculation'] = speculation.start(self.web_scraper, self.executor)
+    
+    def _cancel_speculation(self, state):
+        """Drop a speculative search that stage 5 never claimed"""
+        speculation = state.pop('speculation', None)
+        if speculation is not None:
+            speculation.cancel()
+    
+    def _claim_speculation(self, queries, state):
+        """Reconcile the speculative search with the planned queries
+        
+        Returns (queries still to run, speculative search to use or None).
+        Planned queries that duplicate the speculative one are dropped in its
+        favour; otherwise finished results are merged and a pending search is
+        cancelled, since the planned queries supersede it.
+        """
+        speculation = state.pop('speculation', None)
+        if speculation is None:
+            return queries, None
         
+        remaining = [(query, max_results) for query, max_results in queries
+                     if not self.query_planner.similar(query, speculation.query)]
+        if len(remaining) < len(queries):
+            self.logger.info(
+                f"Speculative search {speculation.query!r} replaces "
+                f"{len(queries) - len(remaining)} planned queries"
+            )
+            return remaining, speculation
+        if speculation.done():
+            self.logger.info(f"Merging finished speculative search {speculation.query!r}")
+            return queries, speculation
+        
+        self.logger.info(f"Cancelled speculative search {speculation.query!r}; planned queries supersede it")
+        speculation.cancel()
+        return queries, None
+    
+    def _finish_request(self, profile, state, results):
+        """Record routing stats and shape the pipeline result"""
+        elapsed = time.perf_counter() - state['started']
+        self.router.record(profile, elapsed, state['upstream_calls'])
+        tracer.observe('pipeline', profile, elapsed)
         return {
-            'thinking_summary': summary_result,
-            'final_response': final_response
+            'thinking_summary': results.get('summary', ""),
+            'final_response': results['final_response'],
+            'degraded': state['degraded'],
+            'profile': profile,
+            'planner': state['planner']
         }
     
-    def _stage_1_think_and_plan(self, user_message, session_id, conversation_history):
+    def _build_stages(self, profile='full', planner='multi'):
+        """Describe the pipeline for a routing profile as a dependency graph of stages"""
+        if profile == 'direct':
+            return [
+                PipelineStage('final_response', self._stage_5_direct_response, inputs=('user_message',)),
+            ]
+        if profile == 'search':
+            return [
+                PipelineStage(
+                    'web_results', self._plan_message_search, inputs=('user_message',),
+                    kind='search', parse=self._merge_web_results, optional=True, default=[]
+                ),
+                PipelineStage(
+                    'final_response', self._stage_5_final_response,
+                    inputs=('user_message', 'web_results'),
+                    degraded_build=self._stage_5_direct_response
+                ),
+            ]
+        
+        if planner == 'compact':
+            planning = [self._compact_planning_stage()]
+        else:
+            planning = self._planning_stages()
+        
+        return planning + [
+            # Stage 5: Web Search and Final Response
+            PipelineStage(
+                'web_results', self._stage_5_plan_searches, inputs=('search_prompt', 'search_topics'),
+                kind='search', parse=self._merge_web_results, optional=True, default=[]
+            ),
+            PipelineStage(
+                'final_response', self._stage_5_final_response,
+                inputs=('user_message', 'summary', 'web_results'),
+                degraded_build=self._stage_5_direct_response
+            ),
+        ]
+    
+    def _compact_planning_stage(self):
+        """Stages 1-4 as a single structured-output call"""
+        return PipelineStage(
+            'plan', self._stage_compact_plan, inputs=('user_message',), kind='plan',
+            provides=('thinking', 'summary', 'search_prompt', 'search_topics')
+        )
+    
+    def _planning_stages(self):
+        """Stages 1-4 as separate upstream calls"""
+        return [
+            # Stage 1: Think and Plan
+            PipelineStage('thinking', self._stage_1_think_and_plan, inputs=('user_message',)),
+            # Stage 2: Summarize Thinking
+            PipelineStage(
+                'summary', self._stage_2_summarize_thinking, inputs=('thinking',),
+                optional=True, default=""
+            ),
+            # Stages 3 and 4 only need the summary, so they run concurrently
+            PipelineStage(
+                'search_prompt', self._stage_3_generate_search_prompt, inputs=('summary',),
+                optional=True, default=""
+            ),
+            PipelineStage(
+                'search_topics', self._stage_4_generate_search_topics, inputs=('summary',),
+                parse=self._parse_search_topics, optional=True, default=[]
+            ),
+        ]
+    
+    def _prepare_stage(self, stage, kwargs, state):
+        """Return (skipped, request), switching to the abbreviated plan once degraded"""
+        if not state['degraded']:
+            return False, stage.build(**kwargs)
+        if stage.optional:
+            return True, None
+        if stage.degraded_build:
+            return False, stage.degraded_build(**kwargs)
+        return False, stage.build(**kwargs)
+    
+    def _settle(self, stage, result, state):
+        """Unwrap a ChatResult, marking the request degraded if it came from the fallback"""
+        if result.source != ChatResult.CACHE:
+            with state['lock']:
+                state['upstream_calls'] += 1
+        if result.degraded:
+            tracer.note(fallback=True)
+        if result.degraded and not state['degraded']:
+            state['degraded'] = True
+            self.logger.warning(
+                f"Stage {stage.name} fell back after {result.latency:.2f}s; "
+                f"skipping summary and web search for this request"
+            )
+        return result.content
+    
+    def _run_stage(self, stage, kwargs, session_id, conversation_history, state):
+        """Execute one stage with blocking I/O"""
+        skipped, request = self._prepare_stage(stage, kwargs, state)
+        if skipped:
+            return stage.default
+        with tracer.span('stage', stage.name), profiler.stage(stage.name):
+            if stage.kind == 'plan':
+                return self._run_compact_plan(stage, request, kwargs, session_id, conversation_history, state)
+            if stage.kind == 'search':
+                queries, speculation = self._claim_speculation(request, state)
+                result = self.web_scraper.search_many(queries) if queries else []
+                if speculation is not None:
+                    result = [speculation.result()] + result
+            else:
+                result = self._settle(
+                    stage, self._ask(stage.name, request, session_id, conversation_history), state
+                )
+            return stage.parse(result) if stage.parse else result
+    
+    async def _run_stage_async(self, stage, kwargs, session_id, conversation_history, state):
+        """Execute one stage on the event loop"""
+        skipped, request = self._prepare_stage(stage, kwargs, state)
+        if skipped:
+            return stage.default
+        with tracer.span('stage', stage.name), profiler.stage(stage.name):
+            if stage.kind == 'plan':
+                return await self._run_compact_plan_async(
+                    stage, request, kwargs, session_id, conversation_history, state
+                )
+            if stage.kind == 'search':
+                queries, speculation = self._claim_speculation(request, state)
+                result = await self.web_scraper.search_many_async(queries) if queries else []
+                if speculation is not None:
+                    result = [await speculation.result_async()] + result
+            else:
+                use_cache = Config.RESPONSE_CACHE_STAGES.get(stage.name, False)
+                result = self._settle(stage, await self.chat_api.send_request_async(
+                    request, conversation_history, session_id, use_cache=use_cache, stage=stage.name
+                ), state)
+            return stage.parse(result) if stage.parse else result
+    
+    def _run_compact_plan(self, stage, prompt, kwargs, session_id, conversation_history, state):
+        """Plan in one call, falling back to the multi-call stages if the JSON is unusable"""
+        content = self._settle(stage, self._ask(stage.name, prompt, session_id, conversation_history), state)
+        plan = self._compact_plan_or_default(content, state)
+        if plan is not None:
+            return plan
+        
+        values = dict(kwargs)
+        for planning_stage in self._planning_stages():
+            stage_kwargs = {name: values[name] for name in planning_stage.inputs}
+            values[planning_stage.name] = self._run_stage(
+                planning_stage, stage_kwargs, session_id, conversation_history, state
+            )
+        return {name: values[name] for name in stage.provides}
+    
+    async def _run_compact_plan_async(self, stage, prompt, kwargs, session_id, conversation_history, state):
+        """Event loop version of _run_compact_plan"""
+        content = self._settle(stage, await self.chat_api.send_request_async(
+            prompt, conversation_history, session_id,
+            use_cache=Config.RESPONSE_CACHE_STAGES.get(stage.name, False), stage=stage.name
+        ), state)
+        plan = self._compact_plan_or_default(content, state)
+        if plan is not None:
+            return plan
+        
+        values = dict(kwargs)
+        for planning_stage in self._planning_stages():
+            stage_kwargs = {name: values[name] for name in planning_stage.inputs}
+            values[planning_stage.name] = await self._run_stage_async(
+                planning_stage, stage_kwargs, session_id, conversation_history, state
+            )
+        return {name: values[name] for name in stage.provides}
+    
+    def _compact_plan_or_default(self, content, state):
+        """Parsed plan, empty defaults if the request is degraded, or None to use the multi-call path"""
+        if state['degraded']:
+            return {'thinking': content, 'summary': "", 'search_prompt': "", 'search_topics': []}
+        plan = self._parse_compact_plan(content)
+        if plan is None:
+            self.logger.warning("Compact plan was not usable JSON; falling back to separate planning calls")
+        return plan
+    
+    def _ask(self, stage, prompt, session_id, conversation_history):
+        """Send a stage prompt upstream, using the response cache if the stage allows it"""
+        use_cache = Config.RESPONSE_CACHE_STAGES.get(stage, False)
+        return self.chat_api.send_request(
+            prompt, conversation_history, session_id, use_cache=use_cache, stage=stage
+        )
+    
+    def _stage_1_think_and_plan(self, user_message):
         """Stage 1: Analyze user request and create response structure plan"""
         
         prompt = f"""
@@ -257,15 +2315,76 @@ class AIReasoningPipeline:
         Create a clear thinking process and response structure plan. Be thorough but concise.
         """
         
-        return self.chat_api.send_request(prompt, conversation_history, session_id)
+        return prompt
+    
+    def _stage_compact_plan(self, user_message):
+        """Stages 1-4 (compact): Plan, summarize and pick searches in one structured reply"""
+        
+        prompt = f"""
+        You are TurboTalk AI's planning processor. Analyze this user request and plan the response in a single pass.
+        
+        User Request: "{user_message}"
+        
+        Work out what the user is really asking for, which category it falls into (Educational Science,
+        Environmental Awareness, Health & Wellness, Community Problem Solving, or General Knowledge/Other),
+        and how the response should be structured.
+        
+        Respond with ONLY a JSON object, no other text, using exactly these keys:
+        {{"plan": "your response structure plan",
+          "summary": "the user intent, information needed and planned approach in under 100 words",
+          "search_query": "one focused web search query",
+          "topics": ["3-5 specific search topics of 2-4 words each"]}}
+        """
+        
+        return prompt
+    
+    def _parse_compact_plan(self, response):
+        """Stages 1-4 (compact): Extract the plan from the reply, or None if it is unusable"""
+        if ChatAPI.is_fallback_text(response):
+            return None
+        
+        # Tolerate code fences, surrounding prose and trailing commas
+        start, end = response.find('{'), response.rfind('}')
+        if start < 0 or end <= start:
+            return None
+        raw = response[start:end + 1]
+        data = None
+        for candidate in (raw, re.sub(r',\s*([}\]])', r'\1', raw)):
+            try:
+                data = json.loads(candidate)
+                break
+            except json.JSONDecodeError:
+                continue
+        if not isinstance(data, dict):
+            return None
+        
+        summary = data.get('summary')
+        search_query = data.get('search_query')
+        topics = data.get('topics', [])
+        if isinstance(topics, str):
+            topics = topics.split(',')
+        if not isinstance(summary, str) or not summary.strip() or not isinstance(search_query, str):
+            return None
+        if not isinstance(topics, list):
+            return None
+        
+        plan = data.get('plan', "")
+        if isinstance(plan, list):
+            plan = "\n".join(str(step) for step in plan)
+        return {
+            'thinking': str(plan),
+            'summary': summary.strip(),
+            'search_prompt': search_query.strip(),
+            'search_topics': [str(topic).strip() for topic in topics if str(topic).strip()][:5]
+        }
     
-    def _stage_2_summarize_thinking(self, thinking_result, session_id, conversation_history):
+    def _stage_2_summarize_thinking(self, thinking):
         """Stage 2: Summarize the thinking process"""
         
         prompt = f"""
         You are TurboTalk AI's thinking summarizer. Take this detailed thinking process and create a clear, concise summary.
         
-        Detailed Thinking: "{thinking_result}"
+        Detailed Thinking: "{thinking}"
         
         Create a brief summary that captures:
         1. The main user intent
@@ -276,15 +2395,15 @@ class AIReasoningPipeline:
         Keep it under 100 words but comprehensive.
         """
         
-        return self.chat_api.send_request(prompt, conversation_history, session_id)
+        return prompt
     
-    def _stage_3_generate_search_prompt(self, summary_result, session_id, conversation_history):
+    def _stage_3_generate_search_prompt(self, summary):
         """Stage 3: Generate optimized search prompt"""
         
         prompt = f"""
         You are TurboTalk AI's search prompt generator. Based on this thinking summary, create an optimized search query.
         
-        Thinking Summary: "{summary_result}"
+        Thinking Summary: "{summary}"
         
         Generate a single, focused search query that would help gather the most relevant information.
         Make it specific, clear, and likely to return quality results.
@@ -292,15 +2411,15 @@ class AIReasoningPipeline:
         Return ONLY the search query, nothing else.
         """
         
-        return self.chat_api.send_request(prompt, conversation_history, session_id)
+        return prompt
     
-    def _stage_4_generate_search_topics(self, summary_result, session_id, conversation_history):
+    def _stage_4_generate_search_topics(self, summary):
         """Stage 4: Generate specific web search topics"""
         
         prompt = f"""
         You are TurboTalk AI's search topic generator. Based on this thinking summary, suggest 3-5 specific topics to search for.
         
-        Thinking Summary: "{summary_result}"
+        Thinking Summary: "{summary}"
         
         Generate 3-5 specific search topics that would provide comprehensive information.
         Each topic should be 2-4 words, focused and searchable.
@@ -308,127 +2427,792 @@ class AIReasoningPipeline:
         Format as: topic1, topic2, topic3, topic4, topic5
         """
         
-        topics_response = self.chat_api.send_request(prompt, conversation_history, session_id)
+        return prompt
+    
+    def _parse_search_topics(self, topics_response):
+        """Stage 4: Split the model's topic list into individual topics"""
+        # Canned fallback text splits into junk "topics", so never parse it
+        if ChatAPI.is_fallback_text(topics_response):
+            return []
         
         # Parse topics
         topics = [topic.strip() for topic in topics_response.split(',') if topic.strip()]
         return topics[:5]  # Limit to 5 topics
     
-    def _stage_5_final_response(self, user_message, summary_result, search_prompt, search_topics, session_id, conversation_history):
-        """Stage 5: Perform web search and generate final response"""
-        
-        # Perform web searches
+    def _plan_message_search(self, user_message):
+        """Search profile: query the web with the opening words of the user's message"""
+        query = self.query_planner.message_query(user_message)
+        return self.query_planner.plan(query, []) if query else []
+    
+    def _stage_5_plan_searches(self, search_prompt, search_topics):
+        """Stage 5: Turn the search prompt and topics into web queries"""
+        # Search using the generated prompt and every distinct topic at once
+        return self.query_planner.plan(search_prompt, search_topics)
+    
+    def _merge_web_results(self, results_per_query):
+        """Stage 5: Flatten per-query search results in query order"""
         all_web_content = []
+        seen_urls = set()
+        for web_results in results_per_query:
+            for result in web_results:
+                # Pages can turn up under more than one query, e.g. the speculative one
+                if result['url'] not in seen_urls:
+                    seen_urls.add(result['url'])
+                    all_web_content.append(result)
+        return all_web_content
+    
+    def _stage_5_final_response(self, user_message, web_results, summary=""):
+        """Stage 5: Build the final response prompt from the summary and web content"""
         
-        # Search using generated prompt
-        if search_prompt.strip():
-            web_results = self.web_scraper.search_web(search_prompt.strip(), max_results=3)
-            all_web_content.extend(web_results)
-        
-        # Search using individual topics
-        for topic in search_topics:
-            if topic.strip():
-                web_results = self.web_scraper.search_web(topic.strip(), max_results=2)
-                all_web_content.extend(web_results)
+        summary_line = f'Your Thinking Summary: "{summary}"' if summary else ""
         
         # Prepare web content summary
         web_summary = ""
-        if all_web_content:
+        if web_results:
             web_summary = "\n\nRelevant Web Information:\n"
-            for i, result in enumerate(all_web_content[:5], 1):
+            for i, result in enumerate(web_results[:5], 1):
                 web_summary += f"{i}. {result['title']}: {result['content'][:200]}...\n"
         
         # Generate final response
         final_prompt = f"""
         You are TurboTalk AI, developed by Rango Productions, created by Rushi Bhavinkumar Soni (CEO and Founder).
         
-        User Question: "{user_message}"
+        User Question: "{user_message}"
+        
+        {summary_line}
+        
+        {web_summary}
+        
+        Instructions:
+        1. Answer as TurboTalk AI from Rango Productions
+        2. If asked about your location/country, say you're from India
+        3. If asked about headquarters/physical location, say "I don't have physical access to specific building locations"
+        4. DO NOT introduce yourself unless specifically asked
+        5. Provide comprehensive, helpful answers with no length restrictions
+        6. Use the web information to enhance your response
+        7. Focus on being helpful for Science for Society themes
+        8. Cover educational, environmental, health, or community aspects when relevant
+        
+        Provide a complete, informative response that helps solve the user's query.
+        """
+        
+        return final_prompt
+    
+    def _stage_5_direct_response(self, user_message, **unused):
+        """Stage 5 (direct): Answer in one step without a summary or web content"""
+        
+        prompt = f"""
+        You are TurboTalk AI, developed by Rango Productions, created by Rushi Bhavinkumar Soni (CEO and Founder).
+        
+        User Question: "{user_message}"
+        
+        Instructions:
+        1. Answer as TurboTalk AI from Rango Productions
+        2. If asked about your location/country, say you're from India
+        3. If asked about headquarters/physical location, say "I don't have physical access to specific building locations"
+        4. DO NOT introduce yourself unless specifically asked
+        5. Focus on being helpful for Science for Society themes
+        
+        Provide a complete, informative response that helps solve the user's query.
+        """
+        
+        return prompt
+
+def dumps_json_bytes(value):
+    """Compact UTF-8 JSON, encoded with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+class ChatMessage:
+    """Compact conversation turn: interned role, content and a numeric timestamp"""
+    
+    __slots__ = ('role', 'content', 'timestamp', 'segment')
+    
+    def __init__(self, role, content, timestamp=None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.segment = None
+    
+    def to_dict(self):
+        return {'role': self.role, 'content': self.content, 'timestamp': self.timestamp}
+    
+    def as_context(self):
+        """Encoded message_history entry and its token estimate, built once per message"""
+        if self.segment is None:
+            encoded = dumps_json_bytes({'role': self.role, 'content': self.content})
+            self.segment = (encoded, ContextBuilder.estimate_tokens(self.content))
+        return self.segment
+    
+    def memory_size(self):
+        """Approximate bytes held by this message (roles are shared, so not counted)"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.content) + sys.getsizeof(self.timestamp)
+        if self.segment is not None:
+            size += sys.getsizeof(self.segment[0])
+        return size
+
+class ContextBuilder:
+    """Chooses the history sent with each upstream call under a per-stage token budget"""
+    
+    MESSAGE_OVERHEAD = 4  # role and separators
+    
+    def __init__(self, budgets=None):
+        self.budgets = budgets or Config.CONTEXT_BUDGETS
+    
+    @staticmethod
+    def estimate_tokens(text):
+        return len(text) // Config.CONTEXT_CHARS_PER_TOKEN + ContextBuilder.MESSAGE_OVERHEAD
+    
+    def budget(self, stage):
+        return self.budgets.get(stage, self.budgets['default'])
+    
+    def build(self, conversation_history, stage=None):
+        """Encoded entries for the newest messages that fit the stage budget, oldest first"""
+        budget = self.budget(stage)
+        if budget <= 0:
+            return []
+        
+        segments = []
+        used = 0
+        for message in reversed(list(conversation_history)[-Config.HISTORY_WINDOW:]):
+            encoded, tokens = message.as_context()
+            if used + tokens > budget:
+                if not segments:
+                    # The latest turn alone is over budget; send its opening instead of nothing
+                    max_chars = (budget - self.MESSAGE_OVERHEAD) * Config.CONTEXT_CHARS_PER_TOKEN
+                    if max_chars > 0:
+                        segments.append(dumps_json_bytes(
+                            {'role': message.role, 'content': message.content[:max_chars]}
+                        ))
+                break
+            segments.append(encoded)
+            used += tokens
+        segments.reverse()
+        return segments
+
+class Conversation:
+    """Per-session state with a ring buffer of the most recent turns"""
+    
+    __slots__ = ('conv_id', 'session_id', 'history', 'last_access')
+    
+    def __init__(self, session_id):
+        self.conv_id = str(uuid.uuid4())
+        self.session_id = session_id
+        self.history = deque(maxlen=Config.HISTORY_WINDOW)
+        self.last_access = time.time()
+    
+    def memory_size(self):
+        """Approximate bytes held by this conversation"""
+        return (sys.getsizeof(self) + sys.getsizeof(self.history)
+                + sum(message.memory_size() for message in self.history))
+
+class ColdHistoryStore:
+    """Optional append-only archive for turns that fall out of the ring buffer"""
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger('ColdHistoryStore')
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+    
+    def _path(self, conv_id):
+        return os.path.join(self.directory, f"{conv_id}.jsonl")
+    
+    def archive(self, conv_id, message):
+        """Append one evicted message to the conversation's archive file"""
+        try:
+            with self.lock, open(self._path(conv_id), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(message.to_dict(), ensure_ascii=False) + "\n")
+        except OSError as e:
+            self.logger.warning(f"Failed to archive message for {conv_id[:8]}...: {str(e)}")
+    
+    def load(self, conv_id):
+        """All archived messages of a conversation, oldest first"""
+        try:
+            with open(self._path(conv_id), 'r', encoding='utf-8') as f:
+                return [ChatMessage(**json.loads(line)) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+class ShardedSessionStore:
+    """Concurrent session map split into independently locked shards
+    
+    Each shard keeps its conversations in an OrderedDict ordered by last
+    access, so the least recently used entries are always at the front and
+    expiry only touches the conversations that actually expire.
+    """
+    
+    def __init__(self, shard_count=None):
+        self.shard_count = shard_count or Config.SESSION_SHARDS
+        self.shards = [
+            {'lock': threading.Lock(), 'conversations': OrderedDict()}
+            for _ in range(self.shard_count)
+        ]
+    
+    def _shard(self, session_id):
+        return self.shards[hash(session_id) % self.shard_count]
+    
+    def _touch(self, shard, session_id):
+        """Get or create a conversation and mark it as used; shard lock must be held"""
+        conversations = shard['conversations']
+        conversation = conversations.get(session_id)
+        created = conversation is None
+        if created:
+            conversation = conversations[session_id] = Conversation(session_id)
+        else:
+            conversations.move_to_end(session_id)
+            conversation.last_access = time.time()
+        return conversation, created
+    
+    def touch(self, session_id):
+        """Return (conversation, created) for a session, creating it if needed"""
+        shard = self._shard(session_id)
+        with shard['lock']:
+            return self._touch(shard, session_id)
+    
+    def append(self, session_id, message):
+        """Append a message to a session's ring buffer
+        
+        Returns (conversation, created, evicted) where evicted is the
+        message pushed out of the window, if any.
+        """
+        shard = self._shard(session_id)
+        with shard['lock']:
+            conversation, created = self._touch(shard, session_id)
+            history = conversation.history
+            evicted = history[0] if len(history) == history.maxlen else None
+            history.append(message)
+            return conversation, created, evicted
+    
+    def snapshot(self, session_id):
+        """Copy of a session's history, safe to read while others append"""
+        shard = self._shard(session_id)
+        with shard['lock']:
+            conversation, created = self._touch(shard, session_id)
+            return list(conversation.history), conversation, created
+    
+    def memory_stats(self):
+        """Approximate resident size of all conversations"""
+        sizes = []
+        for shard in self.shards:
+            with shard['lock']:
+                sizes.extend(conversation.memory_size() for conversation in shard['conversations'].values())
+        return {
+            'sessions': len(sizes),
+            'total_bytes': sum(sizes),
+            'max_session_bytes': max(sizes, default=0),
+            'avg_session_bytes': sum(sizes) // len(sizes) if sizes else 0
+        }
+    
+    def expire(self, max_age):
+        """Remove conversations idle for longer than max_age; returns the removed ones"""
+        cutoff = time.time() - max_age
+        expired = []
+        for shard in self.shards:
+            with shard['lock']:
+                conversations = shard['conversations']
+                while conversations:
+                    session_id, conversation = next(iter(conversations.items()))
+                    if conversation.last_access > cutoff:
+                        break
+                    del conversations[session_id]
+                    expired.append(conversation)
+        return expired
+    
+    def __len__(self):
+        return sum(len(shard['conversations']) for shard in self.shards)
+
+class MemorySessionBackend:
+    """Session backend that keeps conversations in this process only"""
+    
+    name = "memory"
+    
+    def __init__(self):
+        self.store = ShardedSessionStore()
+    
+    def touch(self, session_id):
+        """Return (conv_id, created), creating the session if needed"""
+        conversation, created = self.store.touch(session_id)
+        return conversation.conv_id, created
+    
+    def append(self, session_id, message):
+        """Store a message; returns (conv_id, created, evicted message or None)"""
+        conversation, created, evicted = self.store.append(session_id, message)
+        return conversation.conv_id, created, evicted
+    
+    def history(self, session_id):
+        """Return (recent messages, created)"""
+        history, _, created = self.store.snapshot(session_id)
+        return history, created
+    
+    def expire(self, max_age):
+        """Remove idle sessions and return their conversation ids"""
+        return [conversation.conv_id for conversation in self.store.expire(max_age)]
+    
+    def memory_stats(self):
+        return self.store.memory_stats()
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        pass
+
+class WriteBatcher:
+    """Queues session writes and applies them in batches from a background thread"""
+    
+    def __init__(self, flush_func, name):
+        self.flush_func = flush_func
+        self.pending = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()  # batches are applied one at a time, in order
+        self.wakeup = threading.Event()
+        self.batches = 0
+        self.writes = 0
+        self.logger = logging.getLogger('WriteBatcher')
+        
+        writer_thread = threading.Thread(target=self._run, name=f"{name}-writer", daemon=True)
+        writer_thread.start()
+    
+    def add(self, operation):
+        """Queue a write; a full batch is flushed right away"""
+        with self.lock:
+            self.pending.append(operation)
+            full = len(self.pending) >= Config.SESSION_WRITE_BATCH
+        if full:
+            self.wakeup.set()
+    
+    def flush(self):
+        """Apply every queued write now"""
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return
+            try:
+                self.flush_func(batch)
+                self.batches += 1
+                self.writes += len(batch)
+            except Exception as e:
+                # Keep the writes for the next attempt rather than losing them
+                self.logger.error(f"Failed to write {len(batch)} session updates: {str(e)}")
+                with self.lock:
+                    self.pending[:0] = batch
+    
+    def _run(self):
+        while True:
+            self.wakeup.wait(Config.SESSION_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            self.flush()
+    
+    def stats(self):
+        with self.lock:
+            return {'pending': len(self.pending), 'batches': self.batches, 'writes': self.writes}
+
+class PersistentSessionBackend:
+    """Write batching and a read-through cache of recent messages for external stores
+    
+    Subclasses implement _ensure_session, _write_batch, _load_history and
+    _expire. Messages appended in this process are visible to it at once;
+    other processes see them after the next flush and cache expiry.
+    """
+    
+    name = "persistent"
+    
+    def __init__(self):
+        self.logger = logging.getLogger(f"{self.__class__.__name__}")
+        self.recent = LRUCache(Config.SESSION_CACHE_MAX_BYTES, Config.SESSION_CACHE_TTL, name=f"{self.name}-history")
+        self.conv_ids = LRUCache(Config.SESSION_CACHE_MAX_BYTES // 4, Config.SESSION_TIMEOUT, name=f"{self.name}-sessions")
+        self.cache_locks = [threading.Lock() for _ in range(Config.SESSION_SHARDS)]
+        self.batcher = WriteBatcher(self._write_batch, self.name)
+    
+    def _cache_lock(self, session_id):
+        return self.cache_locks[hash(session_id) % len(self.cache_locks)]
+    
+    @staticmethod
+    def _history_size(messages):
+        return sys.getsizeof(messages) + sum(message.memory_size() for message in messages)
+    
+    def touch(self, session_id):
+        """Return (conv_id, created), creating the session if needed"""
+        conv_id = self.conv_ids.get(session_id)
+        created = False
+        if conv_id is None:
+            conv_id, created = self._ensure_session(session_id)
+            self.conv_ids.set(session_id, conv_id)
+        self.batcher.add(('touch', session_id, time.time()))
+        return conv_id, created
+    
+    def append(self, session_id, message):
+        """Queue a message write and update the cached window"""
+        conv_id, created = self.touch(session_id)
+        with self._cache_lock(session_id):
+            self.batcher.add(('message', session_id, message))
+            recent = self.recent.get(session_id)
+            if recent is not None:
+                recent = (recent + (message,))[-Config.HISTORY_WINDOW:]
+                self.recent.set(session_id, recent, size=self._history_size(recent))
+        return conv_id, created, None
+    
+    def history(self, session_id):
+        """Return (recent messages, created), reading through the cache"""
+        conv_id, created = self.touch(session_id)
+        if created:
+            return [], True
+        
+        with self._cache_lock(session_id):
+            recent = self.recent.get(session_id)
+            if recent is None:
+                # Make this process's own queued writes visible before reading
+                self.batcher.flush()
+                recent = tuple(self._load_history(session_id, Config.HISTORY_WINDOW))
+                self.recent.set(session_id, recent, size=self._history_size(recent))
+        return list(recent), False
+    
+    def expire(self, max_age):
+        """Remove idle sessions and return their conversation ids"""
+        self.batcher.flush()
+        expired = self._expire(time.time() - max_age)
+        for session_id, _ in expired:
+            self.recent.delete(session_id)
+            self.conv_ids.delete(session_id)
+        return [conv_id for _, conv_id in expired]
+    
+    def memory_stats(self):
+        return {'history_cache': self.recent.stats(), 'writes': self.batcher.stats()}
+    
+    def flush(self):
+        self.batcher.flush()
+    
+    def close(self):
+        self.batcher.flush()
+    
+    def _known_conv_id(self, session_id):
+        """Conversation id this process handed out, for recreating a session row
         
-        Your Thinking Summary: "{summary_result}"
+        Another process may have expired the session while it was still
+        cached here; writes then bring the row back rather than leaving
+        messages that no session points to.
+        """
+        return self.conv_ids.get(session_id) or str(uuid.uuid4())
+    
+    @staticmethod
+    def _coalesce(batch):
+        """Split a batch into message rows and the latest touch per session"""
+        messages = []
+        touches = {}
+        for kind, session_id, value in batch:
+            if kind == 'message':
+                messages.append((session_id, value))
+            else:
+                touches[session_id] = max(value, touches.get(session_id, 0))
+        return messages, touches
+
+class SQLiteSessionBackend(PersistentSessionBackend):
+    """Session backend on a shared SQLite database in WAL mode
+    
+    Every message is kept until its session expires; readers only load the
+    most recent window.
+    """
+    
+    name = "sqlite"
+    
+    def __init__(self, path=None):
+        self.path = path or Config.SESSION_DB_PATH
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
         
-        {web_summary}
+        self.pool = queue.LifoQueue()
+        for _ in range(Config.SESSION_DB_POOL_SIZE):
+            db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.pool.put(db)
         
-        Instructions:
-        1. Answer as TurboTalk AI from Rango Productions
-        2. If asked about your location/country, say you're from India
-        3. If asked about headquarters/physical location, say "I don't have physical access to specific building locations"
-        4. DO NOT introduce yourself unless specifically asked
-        5. Provide comprehensive, helpful answers with no length restrictions
-        6. Use the web information to enhance your response
-        7. Focus on being helpful for Science for Society themes
-        8. Cover educational, environmental, health, or community aspects when relevant
+        with self._connection() as db, db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    conv_id TEXT NOT NULL,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access);
+                CREATE TABLE IF NOT EXISTS session_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    timestamp REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS session_messages_session ON session_messages (session_id, id);
+            """)
+        super().__init__()
+    
+    @contextlib.contextmanager
+    def _connection(self):
+        db = self.pool.get()
+        try:
+            yield db
+        finally:
+            self.pool.put(db)
+    
+    def _ensure_session(self, session_id):
+        with self._connection() as db, db:
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO sessions (session_id, conv_id, last_access) VALUES (?, ?, ?)",
+                (session_id, str(uuid.uuid4()), time.time())
+            )
+            conv_id = db.execute(
+                "SELECT conv_id FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+        return conv_id, cursor.rowcount == 1
+    
+    def _write_batch(self, batch):
+        messages, touches = self._coalesce(batch)
+        with self._connection() as db, db:
+            db.executemany(
+                "INSERT INTO session_messages (session_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                [(session_id, m.role, m.content, m.timestamp) for session_id, m in messages]
+            )
+            for session_id, message in messages:
+                touches.setdefault(session_id, message.timestamp)
+            db.executemany(
+                "INSERT INTO sessions (session_id, conv_id, last_access) VALUES (?, ?, ?) "
+                "ON CONFLICT (session_id) DO UPDATE SET last_access = MAX(last_access, excluded.last_access)",
+                [(session_id, self._known_conv_id(session_id), last_access)
+                 for session_id, last_access in touches.items()]
+            )
+    
+    def _load_history(self, session_id, limit):
+        with self._connection() as db:
+            rows = db.execute(
+                "SELECT role, content, timestamp FROM session_messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, limit)
+            ).fetchall()
+        return [ChatMessage(role, content, timestamp) for role, content, timestamp in reversed(rows)]
+    
+    def _expire(self, cutoff):
+        with self._connection() as db, db:
+            expired = db.execute(
+                "SELECT session_id, conv_id FROM sessions WHERE last_access < ?", (cutoff,)
+            ).fetchall()
+            db.executemany("DELETE FROM session_messages WHERE session_id = ?", [(sid,) for sid, _ in expired])
+            db.executemany("DELETE FROM sessions WHERE session_id = ?", [(sid,) for sid, _ in expired])
+        return expired
+    
+    def close(self):
+        super().close()
+        while not self.pool.empty():
+            self.pool.get_nowait().close()
+
+class RESPError(Exception):
+    """Error reply from a Redis-protocol server"""
+
+class RESPClient:
+    """Minimal Redis protocol (RESP2) client with a small connection pool"""
+    
+    def __init__(self, url):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or '127.0.0.1'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.strip('/') or 0)
+        self.pool = queue.LifoQueue()
+    
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=10)
+        connection = (sock, sock.makefile('rb'))
+        setup = []
+        if self.password:
+            setup.append(('AUTH', self.password))
+        if self.db:
+            setup.append(('SELECT', self.db))
+        if setup:
+            self._roundtrip(connection, setup)
+        return connection
+    
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+    
+    def pipeline(self, commands):
+        """Send several commands in one round trip and return their replies"""
+        try:
+            connection = self.pool.get_nowait()
+        except queue.Empty:
+            connection = self._connect()
         
-        Provide a complete, informative response that helps solve the user's query.
-        """
+        try:
+            replies = self._roundtrip(connection, commands)
+        except (OSError, ConnectionError):
+            connection[0].close()
+            raise
+        self.pool.put(connection)
         
-        return self.chat_api.send_request(final_prompt, conversation_history, session_id)
+        for reply in replies:
+            if isinstance(reply, RESPError):
+                raise reply
+        return replies
+    
+    def _roundtrip(self, connection, commands):
+        sock, reader = connection
+        sock.sendall(b''.join(self._encode(command) for command in commands))
+        return [self._read(reader) for _ in commands]
+    
+    @staticmethod
+    def _encode(args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        return b''.join(parts)
+    
+    def _read(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b'+':
+            return rest.decode('utf-8')
+        if prefix == b'-':
+            return RESPError(rest.decode('utf-8'))
+        if prefix == b':':
+            return int(rest)
+        if prefix == b'$':
+            length = int(rest)
+            return None if length < 0 else reader.read(length + 2)[:-2]
+        if prefix == b'*':
+            length = int(rest)
+            return None if length < 0 else [self._read(reader) for _ in range(length)]
+        raise ConnectionError(f"Unexpected reply: {line[:20]!r}")
+
+class RedisSessionBackend(PersistentSessionBackend):
+    """Session backend on any server speaking the Redis protocol
+    
+    Only the most recent window of messages is kept per session, and the
+    server expires idle sessions itself through key TTLs.
+    """
+    
+    name = "redis"
+    KEY_PREFIX = "turbotalk:"
+    
+    def __init__(self, url=None):
+        self.client = RESPClient(url or Config.SESSION_REDIS_URL)
+        super().__init__()
+    
+    def _keys(self, session_id):
+        return f"{self.KEY_PREFIX}session:{session_id}", f"{self.KEY_PREFIX}history:{session_id}"
+    
+    def _ensure_session(self, session_id):
+        session_key, _ = self._keys(session_id)
+        created, conv_id, _ = self.client.pipeline([
+            ('HSETNX', session_key, 'conv_id', str(uuid.uuid4())),
+            ('HGET', session_key, 'conv_id'),
+            ('EXPIRE', session_key, Config.SESSION_TIMEOUT),
+        ])
+        return conv_id.decode('utf-8'), created == 1
+    
+    def _write_batch(self, batch):
+        messages, touches = self._coalesce(batch)
+        commands = []
+        for session_id, message in messages:
+            commands.append(('RPUSH', self._keys(session_id)[1],
+                             json.dumps(message.to_dict(), ensure_ascii=False)))
+        for session_id in set(touches) | {session_id for session_id, _ in messages}:
+            session_key, history_key = self._keys(session_id)
+            commands.append(('HSETNX', session_key, 'conv_id', self._known_conv_id(session_id)))
+            commands.append(('LTRIM', history_key, -Config.HISTORY_WINDOW, -1))
+            commands.append(('EXPIRE', session_key, Config.SESSION_TIMEOUT))
+            commands.append(('EXPIRE', history_key, Config.SESSION_TIMEOUT))
+        if commands:
+            self.client.pipeline(commands)
+    
+    def _load_history(self, session_id, limit):
+        items = self.client.execute('LRANGE', self._keys(session_id)[1], -limit, -1) or []
+        return [ChatMessage(**json.loads(item)) for item in items]
+    
+    def _expire(self, cutoff):
+        return []  # keys carry their own TTL
+
+SESSION_BACKENDS = {
+    MemorySessionBackend.name: MemorySessionBackend,
+    SQLiteSessionBackend.name: SQLiteSessionBackend,
+    RedisSessionBackend.name: RedisSessionBackend,
+}
+
+def create_session_backend(name=None):
+    """Instantiate the configured session backend"""
+    return SESSION_BACKENDS[name or Config.SESSION_BACKEND]()
 
 class ConversationManager:
     """Enhanced conversation management with dual output support"""
-    def __init__(self):
-        self.conversations = {}
-        self.session_map = {}
+    def __init__(self, backend=None):
+        self.backend = backend or create_session_backend()
+        self.cold_storage = (ColdHistoryStore(Config.HISTORY_COLD_STORAGE_DIR)
+                             if Config.HISTORY_COLD_STORAGE_DIR else None)
         self.cleanup_interval = Config.CLEANUP_INTERVAL
         self.session_timeout = Config.SESSION_TIMEOUT
         self.logger = logging.getLogger('ConversationManager')
         
+        # Queued writes must reach the store before the process exits
+        atexit.register(self.backend.close)
+        
         # Start cleanup thread
         cleanup_thread = threading.Thread(target=self._cleanup_old_sessions, daemon=True)
         cleanup_thread.start()
     
+    def _log_created(self, session_id, created):
+        if created:
+            self.logger.info(f"Created new conversation for session {session_id[:8]}...")
+    
+    @tracer.traced('session', 'touch')
     def get_conversation_id(self, session_id):
         """Get or create a conversation ID for a session"""
-        if session_id not in self.session_map:
-            conv_id = str(uuid.uuid4())
-            self.session_map[session_id] = conv_id
-            self.conversations[conv_id] = {
-                'history': [],
-                'last_access': datetime.now(),
-                'session_id': session_id
-            }
-            self.logger.info(f"Created new conversation for session {session_id[:8]}...")
-        return self.session_map[session_id]
+        conv_id, created = self.backend.touch(session_id)
+        self._log_created(session_id, created)
+        return conv_id
     
+    @tracer.traced('session', 'append')
     def add_message(self, session_id, message, role):
         """Add a message to the conversation history"""
         try:
-            conv_id = self.get_conversation_id(session_id)
-            self.conversations[conv_id]['history'].append({
-                'content': message,
-                'role': role,
-                'timestamp': datetime.now().isoformat()
-            })
-            self.conversations[conv_id]['last_access'] = datetime.now()
+            conv_id, created, evicted = self.backend.append(session_id, ChatMessage(role, message))
+            self._log_created(session_id, created)
+            if evicted is not None and self.cold_storage:
+                self.cold_storage.archive(conv_id, evicted)
             self.logger.debug(f"Added message for session {session_id[:8]}...")
         except Exception as e:
             self.logger.error(f"Error adding message: {str(e)}")
             raise
     
+    @tracer.traced('session', 'history')
     def get_history(self, session_id):
         """Get conversation history for a session"""
         try:
-            conv_id = self.get_conversation_id(session_id)
-            return self.conversations[conv_id]['history']
+            history, created = self.backend.history(session_id)
+            self._log_created(session_id, created)
+            return history
         except Exception as e:
             self.logger.error(f"Error getting history: {str(e)}")
             return []
     
+    def get_archived_history(self, session_id):
+        """Turns that fell out of the in-memory window, if cold storage is enabled"""
+        if not self.cold_storage:
+            return []
+        return self.cold_storage.load(self.get_conversation_id(session_id))
+    
+    def memory_stats(self):
+        """Report per-session and total memory held by conversation history"""
+        return self.backend.memory_stats()
+    
     def _cleanup_old_sessions(self):
         """Periodically clean up old sessions"""
         while True:
             try:
-                current_time = datetime.now()
-                expired_convs = []
-                
-                for conv_id, data in self.conversations.items():
-                    if (current_time - data['last_access']).total_seconds() > self.session_timeout:
-                        expired_convs.append(conv_id)
-                        session_id = data['session_id']
-                        if session_id in self.session_map:
-                            del self.session_map[session_id]
-                
-                for conv_id in expired_convs:
-                    del self.conversations[conv_id]
+                for conv_id in self.backend.expire(self.session_timeout):
                     self.logger.info(f"Cleaned up conversation {conv_id[:8]}...")
                 
                 threading.Event().wait(self.cleanup_interval)
@@ -436,8 +3220,218 @@ class ConversationManager:
                 self.logger.error(f"Error in cleanup: {str(e)}")
                 threading.Event().wait(60)
 
+class PooledHTTPAdapter(requests.adapters.HTTPAdapter):
+    """Keep-alive HTTP adapter that counts new versus reused connections"""
+    
+    def __init__(self, idle_timeout, **kwargs):
+        self.idle_timeout = idle_timeout
+        self.stats_lock = threading.Lock()
+        self.requests_sent = 0
+        self.new_connections = 0
+        self.idle_resets = 0
+        self.in_flight = 0
+        self.last_activity = time.monotonic()
+        super().__init__(**kwargs)
+    
+    def init_poolmanager(self, *args, **kwargs):
+        """Swap in connection pools that report every new connection"""
+        super().init_poolmanager(*args, **kwargs)
+        pool_classes = self.poolmanager.pool_classes_by_scheme
+        for scheme, pool_cls in list(pool_classes.items()):
+            pool_classes[scheme] = self._counting_pool(pool_cls)
+    
+    def _counting_pool(self, pool_cls):
+        adapter = self
+        
+        class CountingConnectionPool(pool_cls):
+            def _new_conn(self):
+                with adapter.stats_lock:
+                    adapter.new_connections += 1
+                return super()._new_conn()
+        
+        return CountingConnectionPool
+    
+    def send(self, request, **kwargs):
+        """Send a request, dropping the pool first if it sat idle too long"""
+        with self.stats_lock:
+            now = time.monotonic()
+            if self.in_flight == 0 and now - self.last_activity > self.idle_timeout:
+                self.poolmanager.clear()
+                self.idle_resets += 1
+            self.in_flight += 1
+            self.requests_sent += 1
+            self.last_activity = now
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            with self.stats_lock:
+                self.in_flight -= 1
+                self.last_activity = time.monotonic()
+    
+    def stats(self):
+        """Connection reuse counters"""
+        with self.stats_lock:
+            return {
+                'requests': self.requests_sent,
+                'new_connections': self.new_connections,
+                'reused_connections': max(0, self.requests_sent - self.new_connections),
+                'idle_resets': self.idle_resets,
+                'in_flight': self.in_flight
+            }
+
+class ChatResult:
+    """Outcome of an upstream call: the text, where it came from and how long it took"""
+    
+    UPSTREAM = 'upstream'
+    FALLBACK = 'fallback'
+    CACHE = 'cache'
+    
+    __slots__ = ('content', 'source', 'latency')
+    
+    def __init__(self, content, source, latency):
+        self.content = content
+        self.source = source
+        self.latency = latency
+    
+    @property
+    def degraded(self):
+        return self.source == self.FALLBACK
+    
+    def __repr__(self):
+        return f"ChatResult(source={self.source!r}, latency={self.latency:.3f}, content={self.content[:40]!r})"
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker that fails fast while the upstream is down"""
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, name, failure_threshold=None, recovery_timeout=None, half_open_calls=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or Config.BREAKER_FAILURE_THRESHOLD
+        self.recovery_timeout = recovery_timeout or Config.BREAKER_RECOVERY_TIMEOUT
+        self.half_open_calls = half_open_calls or Config.BREAKER_HALF_OPEN_CALLS
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0
+        self.trial_calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.times_opened = 0
+        self.logger = logging.getLogger('CircuitBreaker')
+    
+    def allow(self):
+        """True if a call may go out; False means use the fallback without any I/O"""
+        with self.lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.recovery_timeout:
+                    self.rejected += 1
+                    return False
+                self.state = self.HALF_OPEN
+                self.trial_calls = 0
+                self.logger.info(f"{self.name}: half-open, letting trial calls through")
+            if self.state == self.HALF_OPEN:
+                if self.trial_calls >= self.half_open_calls:
+                    self.rejected += 1
+                    return False
+                self.trial_calls += 1
+            return True
+    
+    def is_open(self):
+        with self.lock:
+            return self.state == self.OPEN
+    
+    def record_success(self):
+        with self.lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+            if self.state != self.CLOSED:
+                self.logger.info(f"{self.name}: upstream recovered, breaker closed")
+                self.state = self.CLOSED
+    
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+                self.logger.warning(
+                    f"{self.name}: breaker open after {self.consecutive_failures} failures, "
+                    f"failing fast for {self.recovery_timeout}s"
+                )
+    
+    def stats(self):
+        """Current state and call counters"""
+        with self.lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'successes': self.successes,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'times_opened': self.times_opened
+            }
+
+class SSEContentDecoder:
+    """Incremental parser for the upstream SSE stream's delta.content chunks"""
+    
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.buffer = ""
+    
+    def feed(self, raw):
+        """Consume raw bytes and return the content of every complete line"""
+        self.buffer += self.decoder.decode(raw)
+        *lines, self.buffer = self.buffer.split("\n")
+        return [content for line in lines for content in self._parse_line(line.rstrip("\r"))]
+    
+    def close(self):
+        """Flush whatever is left after the stream ends"""
+        self.buffer += self.decoder.decode(b"", final=True)
+        line, self.buffer = self.buffer, ""
+        return list(self._parse_line(line.rstrip("\r")))
+    
+    @staticmethod
+    def _parse_line(line):
+        """Yield the content carried by a single SSE data line"""
+        if not line.startswith("data: "):
+            return
+        try:
+            data = json.loads(line[len("data: "):])
+        except json.JSONDecodeError:
+            return
+        if not isinstance(data, dict):
+            return
+        for choice in data.get("choices", []):
+            content = choice.get("delta", {}).get("content")
+            if content:
+                yield content
+
 class ChatAPI:
     """Enhanced API communication with better error handling"""
+    
+    # Opening text of every canned reply, used to recognise fallback output
+    FALLBACK_PREFIXES = (
+        "Solar energy offers numerous benefits for science and society:",
+        "As TurboTalk AI, I focus on environmental solutions",
+        "Health and wellness are fundamental to thriving communities:",
+        "Community problem-solving requires collaborative approaches:",
+        "Hello! I'm TurboTalk AI from Rango Productions",
+        "I'm here to help with science, environment, health, and community topics.",
+        "No response generated.",
+        "Error processing response.",
+    )
+    
+    # Replies produced when the upstream answered but gave nothing usable
+    ERROR_RESPONSES = ("No response generated.", "Error processing response.")
+    
     def __init__(self):
         self.logger = logging.getLogger('ChatAPI')
         self.headers = {
@@ -446,69 +3440,322 @@ class ChatAPI:
             "Accept": "*/*",
             "Accept-Encoding": "Identity",
         }
+        
+        # One shared keep-alive pool for every request thread
+        self.adapter = PooledHTTPAdapter(
+            idle_timeout=Config.API_KEEPALIVE_IDLE_TIMEOUT,
+            pool_connections=Config.API_POOL_CONNECTIONS,
+            pool_maxsize=Config.API_POOL_MAXSIZE
+        )
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        
+        self.response_cache = LRUCache(
+            Config.RESPONSE_CACHE_MAX_BYTES, Config.RESPONSE_CACHE_TTL, name='responses'
+        )
+        
+        self.context_builder = ContextBuilder()
+        
+        # Shared by every request thread so one outage trips it for all of them
+        self.breaker = CircuitBreaker('upstream')
+        self.inflight = SingleFlight('upstream')
+        
+        # Created on first use inside the serving event loop
+        self.async_client = None
+        self.async_client_loop = None
+    
+    @classmethod
+    def is_fallback_text(cls, text):
+        """True if the text is a canned fallback or error reply rather than model output"""
+        return text.lstrip().startswith(cls.FALLBACK_PREFIXES)
+    
+    def connection_stats(self):
+        """Report connection reuse for the upstream API pool"""
+        return self.adapter.stats()
+    
+    def stats(self):
+        """Breaker state, connection reuse and response cache counters"""
+        return {
+            'breaker': self.breaker.stats(),
+            'connections': self.connection_stats(),
+            'response_cache': self.response_cache.stats(),
+            'coalescing': self.inflight.stats()
+        }
 
-    def send_request(self, inputs, conversation_history, session_id):
-        """Send request to the API and process response with fallback"""
-        formatted_history = [
-            {'role': msg['role'], 'content': msg['content']}
-            for msg in conversation_history[-10:]  # Keep last 10 messages for context
-        ]
+    # Fixed leading fields of every request body, encoded once
+    PAYLOAD_HEAD = dumps_json_bytes({
+        "additional_extension_context": "",
+        "allow_magic_buttons": True,
+        "is_vscode_extension": True,
+    })[:-1] + b',"message_history":['
 
-        payload = {
-            "additional_extension_context": "",
-            "allow_magic_buttons": True,
-            "is_vscode_extension": True,
-            "message_history": formatted_history,
-            "requested_model": Config.MODEL,
-            "user_input": inputs,
-        }
+    def _build_payload(self, inputs, conversation_history, stage=None):
+        """Build the encoded upstream request body
+        
+        History entries are encoded once per message and joined here, so only
+        the new input is serialized per call; retries resend the same bytes.
+        """
+        segments = self.context_builder.build(conversation_history, stage)
+
+        return b''.join((
+            self.PAYLOAD_HEAD,
+            b','.join(segments),
+            b'],"requested_model":', dumps_json_bytes(Config.MODEL),
+            b',"user_input":', dumps_json_bytes(inputs),
+            b'}',
+        ))
+
+    def _cache_key(self, payload):
+        """Content address of a request: model, trimmed history and input"""
+        return hashlib.sha256(payload).hexdigest()
+
+    def send_request(self, inputs, conversation_history, session_id, use_cache=False, stage=None):
+        """Send request to the API and process response with fallback
+        
+        Returns a ChatResult so callers can tell upstream answers from
+        cached ones and from the local fallback.
+        """
+        with tracer.span('upstream', stage or 'chat'):
+            started = time.perf_counter()
+            payload = self._build_payload(inputs, conversation_history, stage)
+            tracer.note(bytes_out=len(payload))
+            
+            cache_key = None
+            if use_cache:
+                cache_key = self._cache_key(payload)
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    tracer.note(cache='hit')
+                    return self._result(cached, ChatResult.CACHE, started)
+                tracer.note(cache='miss')
+
+            if Config.COALESCE_UPSTREAM:
+                # Identical concurrent requests wait for the first one's answer
+                result = self.inflight.do(
+                    cache_key or self._cache_key(payload),
+                    self._post, payload, inputs, conversation_history, cache_key, started
+                )
+            else:
+                result = self._post(payload, inputs, conversation_history, cache_key, started)
+            tracer.note(fallback=result.degraded)
+            return result
 
+    def _post(self, payload, inputs, conversation_history, cache_key, started):
+        """POST an encoded request with retries, backoff and the circuit breaker"""
         for attempt in range(Config.MAX_RETRIES):
+            if not self.breaker.allow():
+                # Upstream is known to be down; answer locally without network I/O
+                return self._fallback_result(inputs, conversation_history, started)
+            attempt_started = time.perf_counter()
             try:
-                response = requests.post(
+                response = self.session.post(
                     Config.API_URL,
-                    json=payload,
+                    data=payload,
                     headers=self.headers,
                     timeout=30
                 )
+                tracer.observe('upstream_attempt', str(response.status_code), time.perf_counter() - attempt_started)
                 
                 if response.status_code == 200:
-                    return self._process_response(response)
-                elif response.status_code in (401, 403, 429):
+                    self.breaker.record_success()
+                    tracer.note(bytes_in=len(response.content))
+                    content = self._process_response(response)
+                    self._remember(cache_key, content)
+                    return self._result(content, ChatResult.UPSTREAM, started)
+                
+                self.breaker.record_failure()
+                if response.status_code in (401, 403, 429):
                     self.logger.warning(f"Attempt {attempt + 1}: Status {response.status_code}")
-                    if attempt == Config.MAX_RETRIES - 1:
+                    if attempt == Config.MAX_RETRIES - 1 or self.breaker.is_open():
                         # Fallback to local processing
-                        return self._fallback_response(inputs, conversation_history)
+                        return self._fallback_result(inputs, conversation_history, started)
                     time.sleep(2 ** attempt)  # Exponential backoff
                 else:
                     if attempt == Config.MAX_RETRIES - 1:
-                        return self._fallback_response(inputs, conversation_history)
+                        return self._fallback_result(inputs, conversation_history, started)
+                    
+            except requests.exceptions.RequestException as e:
+                tracer.observe('upstream_attempt', 'error', time.perf_counter() - attempt_started)
+                self.breaker.record_failure()
+                self.logger.error(f"Request error: {str(e)}")
+                if attempt == Config.MAX_RETRIES - 1:
+                    return self._fallback_result(inputs, conversation_history, started)
+
+    def _result(self, content, source, started):
+        """Wrap response text; empty or unreadable upstream replies count as fallback"""
+        if source == ChatResult.UPSTREAM and content in self.ERROR_RESPONSES:
+            source = ChatResult.FALLBACK
+        return ChatResult(content, source, time.perf_counter() - started)
+
+    def _fallback_result(self, inputs, conversation_history, started):
+        """Answer locally without the upstream"""
+        content = self._fallback_response(inputs, conversation_history)
+        return ChatResult(content, ChatResult.FALLBACK, time.perf_counter() - started)
+
+    def _remember(self, cache_key, content):
+        """Cache a response if caching was requested and it is a genuine upstream answer"""
+        if cache_key and content not in self.ERROR_RESPONSES:
+            self.response_cache.set(cache_key, content)
+
+    def _get_async_client(self):
+        """Shared keep-alive client bound to the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self.async_client is None or self.async_client_loop is not loop:
+            self.async_client = httpx.AsyncClient(
+                timeout=30,
+                limits=httpx.Limits(
+                    max_keepalive_connections=Config.API_POOL_MAXSIZE,
+                    keepalive_expiry=Config.API_KEEPALIVE_IDLE_TIMEOUT
+                )
+            )
+            self.async_client_loop = loop
+        return self.async_client
+
+    async def send_request_async(self, inputs, conversation_history, session_id, use_cache=False, stage=None):
+        """Async counterpart of send_request for the ASGI serving mode"""
+        if httpx is None:
+            # Without an async HTTP client the blocking call runs off the event loop
+            return await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+                contextvars.copy_context().run, functools.partial(
+                    self.send_request, inputs, conversation_history, session_id,
+                    use_cache=use_cache, stage=stage
+                )
+            ))
+        
+        with tracer.span('upstream', stage or 'chat'):
+            started = time.perf_counter()
+            payload = self._build_payload(inputs, conversation_history, stage)
+            tracer.note(bytes_out=len(payload))
+            
+            cache_key = None
+            if use_cache:
+                cache_key = self._cache_key(payload)
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    tracer.note(cache='hit')
+                    return self._result(cached, ChatResult.CACHE, started)
+                tracer.note(cache='miss')
+
+            if Config.COALESCE_UPSTREAM:
+                result = await self.inflight.do_async(
+                    cache_key or self._cache_key(payload),
+                    self._post_async, payload, inputs, conversation_history, cache_key, started
+                )
+            else:
+                result = await self._post_async(payload, inputs, conversation_history, cache_key, started)
+            tracer.note(fallback=result.degraded)
+            return result
+
+    async def _post_async(self, payload, inputs, conversation_history, cache_key, started):
+        """Event loop version of _post"""
+        client = self._get_async_client()
+        for attempt in range(Config.MAX_RETRIES):
+            if not self.breaker.allow():
+                return self._fallback_result(inputs, conversation_history, started)
+            attempt_started = time.perf_counter()
+            try:
+                response = await client.post(Config.API_URL, content=payload, headers=self.headers)
+                tracer.observe('upstream_attempt', str(response.status_code), time.perf_counter() - attempt_started)
+                
+                if response.status_code == 200:
+                    self.breaker.record_success()
+                    tracer.note(bytes_in=len(response.content))
+                    content = self._decode_sse_body(response.content)
+                    self._remember(cache_key, content)
+                    return self._result(content, ChatResult.UPSTREAM, started)
+                
+                self.breaker.record_failure()
+                if response.status_code in (401, 403, 429):
+                    self.logger.warning(f"Attempt {attempt + 1}: Status {response.status_code}")
+                    if attempt == Config.MAX_RETRIES - 1 or self.breaker.is_open():
+                        return self._fallback_result(inputs, conversation_history, started)
+                    await asyncio.sleep(2 ** attempt)  # Exponential backoff
+                else:
+                    if attempt == Config.MAX_RETRIES - 1:
+                        return self._fallback_result(inputs, conversation_history, started)
+                    
+            except httpx.HTTPError as e:
+                tracer.observe('upstream_attempt', 'error', time.perf_counter() - attempt_started)
+                self.breaker.record_failure()
+                self.logger.error(f"Request error: {str(e)}")
+                if attempt == Config.MAX_RETRIES - 1:
+                    return self._fallback_result(inputs, conversation_history, started)
+
+    async def aclose(self):
+        """Close the async client when the event loop shuts down"""
+        if self.async_client is not None:
+            await self.async_client.aclose()
+            self.async_client = None
+
+    def stream_request(self, inputs, conversation_history, session_id, stage=None):
+        """Send request to the API and yield response text as it arrives
+        
+        Retries follow the same policy as send_request until the first chunk
+        has been produced; after that the stream cannot be restarted.
+        """
+        payload = self._build_payload(inputs, conversation_history, stage)
+
+        for attempt in range(Config.MAX_RETRIES):
+            if not self.breaker.allow():
+                yield self._fallback_response(inputs, conversation_history)
+                return
+            try:
+                response = self.session.post(
+                    Config.API_URL,
+                    data=payload,
+                    headers=self.headers,
+                    timeout=30,
+                    stream=True
+                )
+                
+                with response:
+                    if response.status_code == 200:
+                        self.breaker.record_success()
+                        produced = False
+                        for content in self._iter_sse_content(response):
+                            produced = True
+                            yield content
+                        if not produced:
+                            yield "No response generated."
+                        return
+                    
+                    self.breaker.record_failure()
+                    self.logger.warning(f"Attempt {attempt + 1}: Status {response.status_code}")
+                    if attempt == Config.MAX_RETRIES - 1 or self.breaker.is_open():
+                        yield self._fallback_response(inputs, conversation_history)
+                        return
+                    if response.status_code in (401, 403, 429):
+                        time.sleep(2 ** attempt)  # Exponential backoff
                     
             except requests.exceptions.RequestException as e:
+                self.breaker.record_failure()
                 self.logger.error(f"Request error: {str(e)}")
                 if attempt == Config.MAX_RETRIES - 1:
-                    return self._fallback_response(inputs, conversation_history)
+                    yield self._fallback_response(inputs, conversation_history)
+                    return
+
+    def _iter_sse_content(self, response):
+        """Incrementally parse the SSE body and yield each delta.content chunk"""
+        decoder = SSEContentDecoder()
+        for raw in response.iter_content(chunk_size=None):
+            yield from decoder.feed(raw)
+        yield from decoder.close()
+
+    def _decode_sse_body(self, body):
+        """Parse a complete SSE body into the response text"""
+        try:
+            decoder = SSEContentDecoder()
+            return "".join(decoder.feed(body) + decoder.close()) or "No response generated."
+            
+        except Exception as e:
+            self.logger.error(f"Error processing response: {str(e)}")
+            return "Error processing response."
 
     def _process_response(self, response):
         """Process the API response"""
         try:
-            response_content = response.content
-            lines = response_content.decode("utf-8").split("\r\n\r\n")
-            content_values = []
-            
-            for line in lines:
-                if line.startswith("data: "):
-                    try:
-                        data = json.loads(line.split("data: ")[1])
-                        choices = data.get("choices", [])
-                        for choice in choices:
-                            content = choice.get("delta", {}).get("content")
-                            if content:
-                                content_values.append(content)
-                    except json.JSONDecodeError:
-                        continue
-                        
-            return "".join(content_values) or "No response generated."
+            return "".join(self._iter_sse_content(response)) or "No response generated."
             
         except Exception as e:
             self.logger.error(f"Error processing response: {str(e)}")
@@ -520,7 +3767,7 @@ class ChatAPI:
         input_lower = inputs.lower()
         
         # Science Education responses
-        if any(word in input_lower for word in ['physics', 'chemistry', 'biology', 'science', 'equation', 'theory', 'experiment']):
+        if any(word in input_lower for word in Config.TOPIC_KEYWORDS['science']):
             if 'solar' in input_lower or 'renewable' in input_lower or 'energy' in input_lower:
                 return """Solar energy offers numerous benefits for science and society:
 
@@ -547,7 +3794,7 @@ class ChatAPI:
 The latest developments include floating solar farms, agrivoltaics (combining agriculture with solar), and transparent solar panels for building integration."""
 
         # Environmental responses
-        elif any(word in input_lower for word in ['environment', 'climate', 'pollution', 'sustainability', 'carbon', 'green']):
+        elif any(word in input_lower for word in Config.TOPIC_KEYWORDS['environment']):
             return """As TurboTalk AI, I focus on environmental solutions for a sustainable future:
 
 **Current Environmental Challenges:**
@@ -571,7 +3818,7 @@ The latest developments include floating solar farms, agrivoltaics (combining ag
 Together, we can create positive environmental impact through science and community action."""
 
         # Health and wellness responses
-        elif any(word in input_lower for word in ['health', 'medical', 'wellness', 'nutrition', 'fitness', 'mental']):
+        elif any(word in input_lower for word in Config.TOPIC_KEYWORDS['health']):
             return """Health and wellness are fundamental to thriving communities:
 
 **Holistic Health Approach:**
@@ -595,7 +3842,7 @@ Together, we can create positive environmental impact through science and commun
 Remember: I provide general information, not medical advice. Always consult healthcare professionals for personal health concerns."""
 
         # Community problem solving
-        elif any(word in input_lower for word in ['community', 'social', 'problem', 'society', 'help', 'volunteer']):
+        elif any(word in input_lower for word in Config.TOPIC_KEYWORDS['community']):
             return """Community problem-solving requires collaborative approaches:
 
 **Identifying Community Needs:**
@@ -659,25 +3906,87 @@ def setup_logging():
     )
     
     file_handler.setFormatter(logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        '%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s'
     ))
+    file_handler.addFilter(TraceIdFilter())
     
     # Add handler to root logger
     logging.getLogger('').addHandler(file_handler)
 
+def load_secret_key():
+    """Session cookie key shared by every worker and kept across restarts
+    
+    Uses Config.SECRET_KEY when set. Otherwise a random key is generated
+    once into Config.SECRET_KEY_PATH; workers racing to create it all end
+    up reading the same file.
+    """
+    if Config.SECRET_KEY:
+        return Config.SECRET_KEY
+    
+    path = Config.SECRET_KEY_PATH
+    if not os.path.exists(path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+            f.write(os.urandom(32).hex().encode('ascii'))
+        try:
+            os.link(temp_path, path)  # fails if another worker got there first
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temp_path)
+    
+    with open(path, 'rb') as f:
+        return f.read().strip()
+
+class FactorySessionInterface(SecureCookieSessionInterface):
+    """Signed-cookie sessions that run create_app() before the cookie is read
+    
+    Flask opens the session before any before_request hook runs, and the
+    signing key is only loaded by create_app().
+    """
+    
+    def open_session(self, app, request):
+        create_app()
+        return super().open_session(app, request)
+
 # Set up Flask application
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
+app.session_interface = FactorySessionInterface()
 app.permanent_session_lifetime = timedelta(hours=24)
 
-# Initialize enhanced components
-setup_logging()
-conversation_manager = ConversationManager()
-chat_api = ChatAPI()
-web_scraper = WebScraper()
-ai_pipeline = AIReasoningPipeline(chat_api, web_scraper)
+# Enhanced components are built by create_app(), not at import time
+conversation_manager = None
+chat_api = None
+web_scraper = None
+ai_pipeline = None
+components_lock = threading.Lock()
 logger = logging.getLogger('TurboTalkApp')
 
+def create_app():
+    """Application factory: build the shared components once and return the Flask app
+    
+    Importing this module stays cheap and starts no threads, so pre-fork
+    servers can load it in the master and build components in each worker
+    (e.g. `gunicorn 'app:create_app()'`). Serving the module-level app
+    directly still works; the first request builds the components.
+    """
+    global conversation_manager, chat_api, web_scraper, ai_pipeline
+    if ai_pipeline is not None:
+        return app
+    
+    with components_lock:
+        if ai_pipeline is None:
+            setup_logging()
+            app.secret_key = load_secret_key()
+            conversation_manager = ConversationManager()
+            chat_api = ChatAPI()
+            web_scraper = WebScraper()
+            ai_pipeline = AIReasoningPipeline(chat_api, web_scraper)
+    return app
+
 @app.route('/')
 def index():
     """Route for the main page"""
@@ -686,6 +3995,17 @@ def index():
         logger.info(f"New session created: {session['session_id'][:8]}...")
     return render_template('index.html')
 
+@app.before_request
+def start_trace():
+    """Give every request a trace id that tags its log lines"""
+    create_app()
+    tracer.new_trace()
+
+@app.after_request
+def add_trace_header(response):
+    response.headers['X-Trace-Id'] = current_trace_id.get()
+    return response
+
 @app.route('/chat', methods=['POST'])
 def chat():
     """Enhanced chat route with multi-stage AI processing"""
@@ -702,11 +4022,14 @@ def chat():
 
         logger.info(f"Processing request: {user_message[:50]}...")
         
-        # Get conversation history
-        history = conversation_manager.get_history(session_id)
-        
-        # Process through AI reasoning pipeline
-        result = ai_pipeline.process_request(user_message, session_id, history)
+        with profiler.request(session_id):
+            # Get conversation history
+            history = conversation_manager.get_history(session_id)
+            
+            # Process through AI reasoning pipeline
+            result = ai_pipeline.process_request(
+                user_message, session_id, history, planner=request.json.get('planner')
+            )
         
         # Add user message to history
         conversation_manager.add_message(session_id, user_message, Config.BOT_ROLE)
@@ -723,16 +4046,239 @@ def chat():
         logger.error(f"Error in chat endpoint: {str(e)}")
         return jsonify({"error": "An error occurred. Please try again."}), 500
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Chat route that streams the final response over Server-Sent Events"""
+    if 'session_id' not in session:
+        session['session_id'] = str(uuid.uuid4())
+    
+    session_id = session['session_id']
+    user_message = (request.json or {}).get('message', '').strip()
+
+    if not user_message:
+        logger.warning(f"Invalid input: {request.json}")
+        return jsonify({"error": "Please provide a message."}), 400
+
+    logger.info(f"Streaming request: {user_message[:50]}...")
+    history = conversation_manager.get_history(session_id)
+    planner = (request.json or {}).get('planner')
+
+    def sse_event(event, data):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    trace_id = current_trace_id.get()
+
+    def generate():
+        # The body is produced after the view returns, so carry the trace id over
+        current_trace_id.set(trace_id)
+        chunks = []
+        try:
+            with profiler.request(session_id):
+                for event, text in ai_pipeline.process_request_stream(
+                    user_message, session_id, history, planner=planner
+                ):
+                    if event == 'token':
+                        chunks.append(text)
+                    yield sse_event(event, {"text": text})
+            
+            conversation_manager.add_message(session_id, user_message, Config.BOT_ROLE)
+            conversation_manager.add_message(session_id, "".join(chunks), Config.CHAT_HISTORY_BOT_ROLE)
+            yield sse_event('done', {})
+            
+        except Exception as e:
+            logger.error(f"Error in chat stream: {str(e)}")
+            yield sse_event('error', {"error": "An error occurred. Please try again."})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/stats')
+def stats():
+    """Runtime counters for the upstream API, the web cache and session memory"""
+    return jsonify({
+        "upstream": chat_api.stats(),
+        "web_cache": web_scraper.web_cache.stats() if web_scraper.web_cache else None,
+        "web_coalescing": web_scraper.inflight.stats(),
+        "routing": ai_pipeline.router.stats(),
+        "sessions": conversation_manager.memory_stats()
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Latency histograms and counters in the Prometheus text format"""
+    breaker = chat_api.breaker.stats()
+    response_cache = chat_api.response_cache.stats()
+    gauges = [
+        ('breaker_open', {'state': breaker['state']}, int(breaker['state'] != CircuitBreaker.CLOSED)),
+    ]
+    counters = [
+        ('response_cache_hits_total', {}, response_cache['hits']),
+        ('response_cache_misses_total', {}, response_cache['misses']),
+        ('coalesced_waiters_total', {'kind': 'upstream'}, chat_api.inflight.stats()['waiters']),
+        ('coalesced_waiters_total', {'kind': 'web'}, web_scraper.inflight.stats()['waiters']),
+    ]
+    for profile, stats in ai_pipeline.router.stats().items():
+        counters.append(('routed_requests_total', {'profile': profile}, stats['requests']))
+    sessions = conversation_manager.memory_stats()
+    if 'total_bytes' in sessions:  # only the in-process store holds history in memory
+        gauges.append(('sessions', {}, sessions['sessions']))
+        gauges.append(('session_memory_bytes', {'stat': 'total'}, sessions['total_bytes']))
+        gauges.append(('session_memory_bytes', {'stat': 'max'}, sessions['max_session_bytes']))
+    return Response(tracer.render(gauges, counters), mimetype='text/plain; version=0.0.4')
+
+class AsyncChatServer:
+    """ASGI entry point: /chat runs on the event loop, every other route is served by Flask
+    
+    Run with `python app.py --asgi` or `uvicorn app:asgi_app`. Sessions use
+    the same signed cookie as the Flask app, so both modes can serve a page.
+    """
+    
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = None
+        self.logger = logging.getLogger('AsyncChatServer')
+    
+    async def __call__(self, scope, receive, send):
+        create_app()
+        if self.wsgi is None and asgiref_wsgi is not None:
+            self.wsgi = asgiref_wsgi.WsgiToAsgi(self.flask_app)
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['path'] == '/chat' and scope['method'] == 'POST':
+            await self._chat(scope, receive, send)
+        elif self.wsgi is not None:
+            await self.wsgi(scope, receive, send)
+        else:
+            await self._send_json(send, 404, {"error": "Not found."})
+    
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await chat_api.aclose()
+                await web_scraper.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    
+    async def _chat(self, scope, receive, send):
+        """Async version of the /chat route"""
+        tracer.new_trace()
+        try:
+            body = b''
+            while True:
+                message = await receive()
+                body += message.get('body', b'')
+                if not message.get('more_body'):
+                    break
+            
+            session_id, set_cookie = self._load_session(scope)
+            try:
+                data = json.loads(body or b'{}')
+            except json.JSONDecodeError:
+                data = {}
+            user_message = str(data.get('message', '')).strip() if isinstance(data, dict) else ''
+            
+            if not user_message:
+                logger.warning(f"Invalid input: {body[:100]!r}")
+                await self._send_json(send, 400, {"error": "Please provide a message."}, set_cookie)
+                return
+            
+            logger.info(f"Processing request: {user_message[:50]}...")
+            # Session stores other than memory block on disk or network I/O
+            history = await self._blocking(conversation_manager.get_history, session_id)
+            result = await ai_pipeline.process_request_async(
+                user_message, session_id, history, planner=data.get('planner')
+            )
+            
+            await self._blocking(conversation_manager.add_message, session_id, user_message, Config.BOT_ROLE)
+            await self._blocking(
+                conversation_manager.add_message, session_id, result['final_response'], Config.CHAT_HISTORY_BOT_ROLE
+            )
+            
+            await self._send_json(send, 200, {
+                "thinking_summary": result['thinking_summary'],
+                "final_response": result['final_response']
+            }, set_cookie)
+            
+        except Exception as e:
+            logger.error(f"Error in async chat endpoint: {str(e)}")
+            await self._send_json(send, 500, {"error": "An error occurred. Please try again."})
+    
+    @staticmethod
+    async def _blocking(func, *args):
+        """Run a blocking call on the default thread pool, keeping the trace context"""
+        return await asyncio.get_running_loop().run_in_executor(
+            None, contextvars.copy_context().run, func, *args
+        )
+    
+    def _load_session(self, scope):
+        """Read the session id from Flask's signed cookie, creating one if needed"""
+        cookie_name = self.flask_app.config['SESSION_COOKIE_NAME']
+        serializer = self.flask_app.session_interface.get_signing_serializer(self.flask_app)
+        
+        cookies = SimpleCookie()
+        for name, value in scope.get('headers', []):
+            if name == b'cookie':
+                cookies.load(value.decode('latin-1'))
+        
+        data = {}
+        if cookie_name in cookies:
+            try:
+                data = serializer.loads(
+                    cookies[cookie_name].value,
+                    max_age=int(self.flask_app.permanent_session_lifetime.total_seconds())
+                )
+            except BadSignature:
+                data = {}
+        
+        if data.get('session_id'):
+            return data['session_id'], None
+        
+        session_id = str(uuid.uuid4())
+        data['session_id'] = session_id
+        set_cookie = f"{cookie_name}={serializer.dumps(data)}; HttpOnly; Path=/"
+        return session_id, set_cookie
+    
+    @staticmethod
+    async def _send_json(send, status, payload, set_cookie=None):
+        body = json.dumps(payload).encode('utf-8')
+        headers = [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode('ascii')),
+            (b'x-trace-id', current_trace_id.get().encode('ascii')),
+        ]
+        if set_cookie:
+            headers.append((b'set-cookie', set_cookie.encode('latin-1')))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+asgi_app = AsyncChatServer(app)
+
 def open_browser():
     """Open the browser when the application starts"""
     try:
+        import webbrowser
         webbrowser.open("http://127.0.0.1:8080")
     except Exception as e:
         logger.error(f"Error opening browser: {str(e)}")
 
 if __name__ == '__main__':
+    # Initialize colorama for cross-platform compatibility
+    from colorama import init
+    init(autoreset=True)
+    
+    create_app()
     try:
         logger.info("Starting Enhanced TurboTalk AI...")
-        app.run(host='0.0.0.0', port=8080, debug=False)
+        if '--asgi' in sys.argv:
+            import uvicorn
+            uvicorn.run(asgi_app, host='0.0.0.0', port=8080)
+        else:
+            app.run(host='0.0.0.0', port=8080, debug=False)
     except Exception as e:
         logger.critical(f"Application failed to start: {str(e)}")
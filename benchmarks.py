@@ -0,0 +1,477 @@
+# TurboTalk AI - Benchmark Harness
+# Offline performance measurements for the TurboTalk AI hot paths
+# Developed by Rango Productions
+#
+# Usage:
+#   python benchmarks.py extract --corpus saved_pages/ --backends soup lxml  # checks output parity first
+#   python benchmarks.py payload --lengths 0 5 10 20 40
+#   python benchmarks.py planner --messages 20 --upstream-latency 0.3
+#   python benchmarks.py load --target pipeline flask --concurrency 8 --requests 200 --token-rate 50
+#   python benchmarks.py startup  # exits non-zero if a cold start exceeds STARTUP_BUDGET_MS
+
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import app
+
+def load_corpus(path):
+    """Read every saved .html/.htm page under a directory"""
+    pages = []
+    for pattern in ('**/*.html', '**/*.htm'):
+        for filename in sorted(glob.glob(os.path.join(path, pattern), recursive=True)):
+            with open(filename, 'r', encoding='utf-8', errors='replace') as f:
+                pages.append(f.read())
+    return pages
+
+def synthetic_corpus(count=50):
+    """Generate article-like pages when no saved corpus is available"""
+    paragraph = "<p>Solar panels convert sunlight into electricity using photovoltaic cells. " * 20 + "</p>"
+    pages = []
+    for i in range(count):
+        pages.append(
+            "<html><head><title>Page {0}</title><style>body {{ margin: 0 }}</style>"
+            "<script>var tracking = {0};</script></head><body>"
+            "<header><nav>{1}</nav></header>"
+            "<div class='sidebar'>{2}</div>"
+            "<article><h1>Article {0}</h1>{3}</article>"
+            "<aside>{2}</aside><footer>{1}</footer></body></html>".format(
+                i, "<a href='#'>Link</a>" * 50, paragraph * 2, paragraph * (5 + i % 10)
+            )
+        )
+    return pages
+
+# Markup where a content container holds nested elements with the same tag name
+PARITY_PAGES = [
+    "<html><body><div class='content'><div>A</div>B</div><p>C</p></body></html>",
+    "<html><body><div id='content'><div>A<div>x</div></div>B</div>Z</body></html>",
+    "<html><body><div class='content'><div id='main'>A</div>B</div>C</body></html>",
+    "<html><body><article><article>Inner</article>Outer</article>Tail</body></html>",
+]
+
+def check_extractor_parity(backends, pages):
+    """Return pages where a backend's extracted text differs from the soup reference"""
+    reference = app.get_html_extractor('soup')
+    mismatches = []
+    for backend in backends:
+        if backend == 'soup':
+            continue
+        extractor = app.get_html_extractor(backend)
+        for index, page in enumerate(pages):
+            expected = reference.extract_content(page)
+            actual = extractor.extract_content(page)
+            if actual != expected:
+                mismatches.append(f"{backend} page {index}: {actual[:60]!r} != soup {expected[:60]!r}")
+    return mismatches
+
+def _measure_extractor(backend, pages, repeat):
+    """Run one backend over the corpus; executed in a fresh process"""
+    extractor = app.get_html_extractor(backend)
+    total_bytes = sum(len(page.encode('utf-8')) for page in pages) * repeat
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            extractor.extract_content(page)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'backend': extractor.name,
+        'pages_per_sec': len(pages) * repeat / elapsed,
+        'mb_per_sec': total_bytes / elapsed / (1024 * 1024),
+        'python_peak_kb': peak / 1024,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+def bench_extract(args):
+    """Compare HTML extractor throughput and peak memory across backends"""
+    if args.corpus:
+        pages = load_corpus(args.corpus)
+        if not pages:
+            raise SystemExit(f"No .html files found under {args.corpus}")
+    else:
+        pages = synthetic_corpus()
+        print("No --corpus given; using a synthetic corpus")
+
+    mismatches = check_extractor_parity(args.backends, PARITY_PAGES + pages)
+    if mismatches:
+        raise SystemExit("Extractor output differs from soup:\n" + "\n".join(mismatches))
+
+    print(f"Corpus: {len(pages)} pages, {sum(len(p) for p in pages) / 1024:.0f} KB, repeat={args.repeat}")
+    print(f"{'backend':<10}{'pages/s':>12}{'MB/s':>10}{'py peak KB':>14}{'max RSS KB':>14}")
+
+    # A fresh process per backend keeps peak RSS figures independent
+    context = multiprocessing.get_context('spawn')
+    for backend in args.backends:
+        with context.Pool(1) as pool:
+            result = pool.apply(_measure_extractor, (backend, pages, args.repeat))
+        print(f"{result['backend']:<10}{result['pages_per_sec']:>12.1f}{result['mb_per_sec']:>10.2f}"
+              f"{result['python_peak_kb']:>14.0f}{result['max_rss_kb']:>14}")
+
+def _legacy_payload(inputs, history):
+    """Request body as it was built before pre-serialization: fresh dicts, encoded whole"""
+    payload = {
+        "additional_extension_context": "",
+        "allow_magic_buttons": True,
+        "is_vscode_extension": True,
+        "message_history": [{'role': msg.role, 'content': msg.content} for msg in history],
+        "requested_model": app.Config.MODEL,
+        "user_input": inputs,
+    }
+    return json.dumps(payload).encode('utf-8')
+
+def bench_payload(args):
+    """Per-call request serialization cost against history length"""
+    # Lift the window and budgets so every message in the history is sent
+    app.Config.HISTORY_WINDOW = max(args.lengths)
+    chat_api = app.ChatAPI()
+    chat_api.context_builder = app.ContextBuilder(budgets={'default': 10 ** 9})
+    inputs = "Summarize the thinking above. " * 20
+    encoder = 'orjson' if app.orjson is not None else 'json'
+
+    print(f"Message size: {args.message_chars} chars, calls per point: {args.calls}, encoder: {encoder}")
+    print(f"{'history':>8}{'legacy us/call':>16}{'cached us/call':>16}{'speedup':>10}{'body KB':>10}")
+    for length in args.lengths:
+        history = [
+            app.ChatMessage('user' if i % 2 == 0 else 'assistant', f"Turn {i}: " + "x" * args.message_chars)
+            for i in range(length)
+        ]
+
+        start = time.perf_counter()
+        for _ in range(args.calls):
+            _legacy_payload(inputs, history)
+        legacy = (time.perf_counter() - start) / args.calls
+
+        body = chat_api._build_payload(inputs, history)  # first call encodes every message
+        start = time.perf_counter()
+        for _ in range(args.calls):
+            chat_api._build_payload(inputs, history)
+        cached = (time.perf_counter() - start) / args.calls
+
+        print(f"{length:>8}{legacy * 1e6:>16.1f}{cached * 1e6:>16.1f}{legacy / cached:>9.1f}x{len(body) / 1024:>10.1f}")
+
+class MockUpstream:
+    """Local stand-in for the chat API and a search engine
+    
+    Chat replies are streamed in the upstream SSE format one word-sized token
+    at a time, after a fixed time to first token; token_rate caps tokens per
+    second (None streams as fast as possible). Article pages are served from
+    `pages`, e.g. a saved corpus, cycling through them by result number.
+    """
+
+    PLAN_REPLY = json.dumps({
+        "plan": "Explain the principle, then the benefits, then current research.",
+        "summary": "The user wants an explanation of how solar panels work and why they matter.",
+        "search_query": "how photovoltaic solar panels work",
+        "topics": ["photovoltaic effect", "solar panel efficiency", "solar energy storage"]
+    })
+    TOPICS_REPLY = "photovoltaic effect, solar panel efficiency, solar energy storage"
+    TEXT_REPLY = "Solar panels turn sunlight into electricity through the photovoltaic effect. " * 4
+
+    def __init__(self, latency=0.2, token_rate=None, pages=None):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.pages = pages or synthetic_corpus(3)
+        self.chat_calls = 0
+        self.search_calls = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        # The scraper closes page downloads early once it has enough text
+        self.server.handle_error = lambda request, client_address: None
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def install(self):
+        """Point the app's upstream and search engines at this server"""
+        app.Config.API_URL = f"{self.base_url}/agent/"
+        # Distinct URLs so the two engines are not merged by request coalescing
+        app.Config.WEB_SEARCH_ENGINES = [
+            f"{self.base_url}/search/duckduckgo.com?engine={engine}&q={{query}}" for engine in range(2)
+        ]
+
+    def reply_for(self, prompt):
+        if '"search_query"' in prompt:
+            return self.PLAN_REPLY
+        if 'search topic generator' in prompt:
+            return self.TOPICS_REPLY
+        # Tag free text with its prompt so later stages of different requests
+        # send different payloads and are not merged by upstream coalescing
+        return f"{self.TEXT_REPLY}Reference {zlib.crc32(prompt.encode('utf-8')):08x}."
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                with mock.lock:
+                    mock.chat_calls += 1
+                reply = mock.reply_for(body.get('user_input', ''))
+                time.sleep(mock.latency)
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for token in re.findall(r'\S+\s*', reply):
+                    self._chunk(('data: ' + json.dumps({"choices": [{"delta": {"content": token}}]})
+                                 + '\n\n').encode('utf-8'))
+                    if mock.token_rate:
+                        time.sleep(1 / mock.token_rate)
+                self._chunk(b'data: [DONE]\n\n')
+                self.wfile.write(b'0\r\n\r\n')
+
+            def _chunk(self, data):
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+            def do_GET(self):
+                if self.path.startswith('/search'):
+                    with mock.lock:
+                        mock.search_calls += 1
+                    links = ''.join(f'<a class="result__a" href="{mock.base_url}/page/{i}">Result {i}</a>'
+                                    for i in range(3))
+                    body = f"<html><body>{links}</body></html>"
+                else:
+                    page = self.path.rsplit('/', 1)[-1]
+                    body = mock.pages[int(page) % len(mock.pages) if page.isdigit() else 0]
+                time.sleep(mock.latency / 4)
+                data = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+def _offline_pipeline(mock):
+    """Fresh pipeline wired to the mock upstream with every cache disabled"""
+    mock.install()
+    app.Config.WEB_CACHE_ENABLED = False
+    app.Config.RESPONSE_CACHE_STAGES = {stage: False for stage in app.Config.RESPONSE_CACHE_STAGES}
+    app.Config.ROUTING_ENABLED = False  # always run the full pipeline
+    return app.AIReasoningPipeline(app.ChatAPI(), app.WebScraper())
+
+def bench_planner(args):
+    """End-to-end latency and upstream calls per message for each planner mode"""
+    mock = MockUpstream(latency=args.upstream_latency).start()
+    pipeline = _offline_pipeline(mock)
+    message = "How do solar panels work and why do they matter?"
+
+    print(f"Mock upstream latency: {args.upstream_latency}s per call, messages per mode: {args.messages}")
+    print(f"{'planner':<10}{'mean s':>10}{'p50 s':>10}{'max s':>10}{'upstream/msg':>14}{'searches/msg':>14}")
+    for mode in args.modes:
+        latencies = []
+        chat_calls, search_calls = mock.chat_calls, mock.search_calls
+        for i in range(args.messages):
+            start = time.perf_counter()
+            pipeline.process_request(message, f"bench-{mode}-{i}", [], planner=mode)
+            latencies.append(time.perf_counter() - start)
+        per_chat = (mock.chat_calls - chat_calls) / args.messages
+        per_search = (mock.search_calls - search_calls) / args.messages
+        print(f"{mode:<10}{statistics.mean(latencies):>10.3f}{statistics.median(latencies):>10.3f}"
+              f"{max(latencies):>10.3f}{per_chat:>14.1f}{per_search:>14.1f}")
+    mock.stop()
+
+def _percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+def _pipeline_driver(pipeline):
+    """One request straight through AIReasoningPipeline.process_request"""
+    def send(i):
+        result = pipeline.process_request(
+            f"How do solar panels work and why do they matter? (request {i})", f"bench-load-{i}", []
+        )
+        return not result['degraded']
+    return send
+
+def _flask_driver(pipeline):
+    """One request through the Flask /chat route, a fresh session each time"""
+    app.ai_pipeline = pipeline  # the route looks the pipeline up at call time
+
+    def send(i):
+        client = app.app.test_client()
+        response = client.post('/chat', json={
+            'message': f"How do solar panels work and why do they matter? (request {i})"
+        })
+        return response.status_code == 200
+    return send
+
+LOAD_DRIVERS = {
+    'pipeline': _pipeline_driver,
+    'flask': _flask_driver
+}
+
+def bench_load(args):
+    """Throughput, latency percentiles and upstream calls per request under concurrent load"""
+    app.create_app()  # configures logging, so quieten it afterwards
+    logging.getLogger().setLevel(logging.WARNING)  # per-request INFO lines would swamp the report
+    pages = load_corpus(args.corpus) if args.corpus else None
+    mock = MockUpstream(latency=args.upstream_latency, token_rate=args.token_rate, pages=pages).start()
+    pipeline = _offline_pipeline(mock)
+    rate = f"{args.token_rate} tokens/s" if args.token_rate else "unthrottled"
+
+    print(f"Mock upstream: {args.upstream_latency}s to first token, {rate}; "
+          f"{args.requests} requests per target at concurrency {args.concurrency}")
+    print(f"{'target':<10}{'req/s':>9}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}{'errors':>8}"
+          f"{'upstream/req':>14}{'searches/req':>14}{'max RSS KB':>12}")
+    regressions = []
+    for target in args.target:
+        send = LOAD_DRIVERS[target](pipeline)
+        latencies = []
+
+        def timed(i):
+            start = time.perf_counter()
+            ok = send(i)
+            latencies.append(time.perf_counter() - start)
+            return ok
+
+        chat_calls, search_calls = mock.chat_calls, mock.search_calls
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            outcomes = list(pool.map(timed, range(args.requests)))
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        p95 = _percentile(latencies, 0.95)
+        print(f"{target:<10}{args.requests / elapsed:>9.1f}{_percentile(latencies, 0.50):>9.3f}{p95:>9.3f}"
+              f"{_percentile(latencies, 0.99):>9.3f}{outcomes.count(False):>8}"
+              f"{(mock.chat_calls - chat_calls) / args.requests:>14.2f}"
+              f"{(mock.search_calls - search_calls) / args.requests:>14.2f}"
+              f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss:>12}")
+        if args.max_p95 and p95 > args.max_p95:
+            regressions.append(f"{target} p95 {p95:.3f}s exceeds the {args.max_p95}s budget")
+    mock.stop()
+
+    if regressions:
+        raise SystemExit("\n".join(regressions))
+
+# Cold start budget per app (import plus create_app); `startup` fails above it
+STARTUP_BUDGET_MS = 500
+
+STARTUP_PROBE = """
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+print(json.dumps({'import': imported - start, 'create_app': time.perf_counter() - imported}))
+"""
+
+def _cold_start(path):
+    """Import an app module and run its factory in a fresh interpreter
+    
+    Returns wall times plus the cumulative -X importtime cost, in seconds,
+    of each module the app imports directly.
+    """
+    with tempfile.TemporaryDirectory() as workdir:  # keeps logs/ and cache/ out of the tree
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP_PROBE, os.path.dirname(os.path.abspath(path))],
+            cwd=workdir, capture_output=True, text=True, check=True
+        )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| {3}(\S+)$', line)
+        if match:  # three spaces: imported directly by the app module
+            modules[match.group(2)] = int(match.group(1)) / 1e6
+    return timings, modules
+
+def bench_startup(args):
+    """Cold import and factory cost per app, checked against a budget"""
+    regressions = []
+    for path in args.apps:
+        runs = sorted((_cold_start(path) for _ in range(args.runs)), key=lambda run: run[0]['import'])
+        timings, modules = runs[len(runs) // 2]  # the median run by import time
+        total = timings['import'] + timings['create_app']
+
+        print(f"{path}: import {timings['import'] * 1000:.0f} ms, create_app {timings['create_app'] * 1000:.0f} ms "
+              f"(median of {args.runs} cold starts)")
+        for name, seconds in sorted(modules.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"  {name:<28}{seconds * 1000:>9.1f} ms")
+        if args.budget_ms and total * 1000 > args.budget_ms:
+            regressions.append(f"{path} cold start {total * 1000:.0f} ms exceeds the {args.budget_ms} ms budget")
+
+    if regressions:
+        raise SystemExit("\n".join(regressions))
+
+def main():
+    parser = argparse.ArgumentParser(description="TurboTalk AI benchmark harness")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    extract = commands.add_parser('extract', help="HTML extraction throughput and memory")
+    extract.add_argument('--corpus', help="directory of saved HTML pages")
+    extract.add_argument('--backends', nargs='+', default=sorted(app.HTML_EXTRACTORS),
+                         choices=sorted(app.HTML_EXTRACTORS))
+    extract.add_argument('--repeat', type=int, default=5)
+    extract.set_defaults(func=bench_extract)
+
+    payload = commands.add_parser('payload', help="upstream request serialization cost")
+    payload.add_argument('--lengths', nargs='+', type=int, default=[0, 2, 5, 10, 20, 40])
+    payload.add_argument('--message-chars', type=int, default=1500)
+    payload.add_argument('--calls', type=int, default=2000)
+    payload.set_defaults(func=bench_payload)
+
+    planner = commands.add_parser('planner', help="multi-call vs compact planning, end to end")
+    planner.add_argument('--messages', type=int, default=10)
+    planner.add_argument('--upstream-latency', type=float, default=0.3)
+    planner.add_argument('--modes', nargs='+', default=list(app.AIReasoningPipeline.PLANNER_MODES),
+                         choices=app.AIReasoningPipeline.PLANNER_MODES)
+    planner.set_defaults(func=bench_planner)
+
+    load = commands.add_parser('load', help="concurrent end-to-end load against a mock upstream")
+    load.add_argument('--target', nargs='+', default=sorted(LOAD_DRIVERS), choices=sorted(LOAD_DRIVERS))
+    load.add_argument('--requests', type=int, default=100)
+    load.add_argument('--concurrency', type=int, default=8)
+    load.add_argument('--upstream-latency', type=float, default=0.2, help="seconds to first token")
+    load.add_argument('--token-rate', type=float, help="streamed tokens per second per reply")
+    load.add_argument('--corpus', help="directory of saved article HTML to serve as result pages")
+    load.add_argument('--max-p95', type=float, help="exit non-zero if any target's p95 exceeds this")
+    load.set_defaults(func=bench_load)
+
+    startup = commands.add_parser('startup', help="cold import cost per module, with a budget")
+    startup.add_argument('--apps', nargs='+', default=['app.py', os.path.join('Webui_AI', 'app.py')])
+    startup.add_argument('--runs', type=int, default=5)
+    startup.add_argument('--top', type=int, default=10, help="directly imported modules to list")
+    startup.add_argument('--budget-ms', type=float, default=STARTUP_BUDGET_MS,
+                         help="exit non-zero if import plus create_app exceeds this; 0 disables the check")
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()